@@ -1,56 +1,120 @@
+import hashlib
+import os
+
 import streamlit as st
 import pandas as pd
 import numpy as np
 import altair as alt
+import matplotlib
 from plot import *
+from engine import (
+    apply_undecided,
+    compact_result,
+    compile_overrides,
+    default_hard_base_party,
+    default_undecided_malay,
+    excluded_states,
+    default_age_turnout,
+    default_votertype_turnout,
+    load_parameters,
+    parameter_turnout,
+    parlimen_index,
+    parties,
+    project_duns,
+    project_states,
+    roll_up_duns,
+    scenario_data,
+    seat_diff,
+    simulate,
+    standing_parties,
+    turnout_factor,
+    winner_codes,
+)
+from flips import flip_index, flips, marginal_seats
+from solver import solve_target
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from store import (
+    cached_result,
+    delete_scenario,
+    list_scenarios,
+    load_scenario,
+    save_scenario,
+    scenario_hash,
+    store_result,
+)
+from timing import new_run, stage, timings_frame
+from loader import (
+    DATA_PATH,
+    DATA_PATH_GE15,
+    OVERRIDES_PATH,
+    REGION_PARAMETERS_PATHS,
+    load_new_voters,
+    load_overrides_frame,
+    file_hash,
+    load_voters_ge15,
+    source_signature,
+)
 
 st.set_page_config(
     page_title="General Election", layout="wide",
 )
 st.title("General Election")
-DATA_PATH = "data/new_voters.csv"
-DATA_PATH_GE15 = "data/voters_ge15.csv"
 
 
-@st.cache(allow_output_mutation=True)
-def load_data():
-    df = pd.read_csv(DATA_PATH)
+# One base dataset per server process, shared by every session without
+# copying, and rebuilt only when a source file's signature changes. Nothing
+# may modify these frames in place; per-session work goes into new objects.
+@st.cache_resource(show_spinner=False, max_entries=1)
+def load_dataset(signatures):
+    adf = load_new_voters(DATA_PATH)
     # df = df[~df["state"].isin(["Sarawak", "Sabah"])].copy()
-    return df
+    df = adf[~adf["state"].isin(excluded_states)].copy()
+    gdf = load_voters_ge15(DATA_PATH_GE15)
+    overrides = load_overrides_frame(OVERRIDES_PATH)
+    if overrides is not None:
+        overrides = compile_overrides(overrides, df)
+    version = "-".join(
+        file_hash(i)[:12]
+        for i in [DATA_PATH, DATA_PATH_GE15] + REGION_PARAMETERS_PATHS
+    )
+    if overrides is not None:
+        version += "-" + overrides["key"][:12]
 
+    return {
+        "adf": adf,
+        "df": df,
+        "gdf": gdf,
+        "age_cube": age_cube(gdf),
+        # age pyramid figures by region, shared read-only across sessions
+        "figure_cache": {},
+        "voter_cube": voter_cube(adf, gdf),
+        # DUN -> seat row in df, for the age-aware turnout model
+        "parlimen_index": parlimen_index(gdf, df),
+        "para_data": load_parameters(REGION_PARAMETERS_PATHS),
+        "history": winner_codes(df),
+        # per-seat overrides from OVERRIDES_PATH, None without the file
+        "overrides": overrides,
+        # content version of the source files, part of every stored result key
+        "version": version,
+        # per-state projections, shared across sessions (see project_states)
+        "state_cache": {},
+    }
 
-@st.cache(allow_output_mutation=True)
-def load_data_GE15():
-    df = pd.read_csv(DATA_PATH_GE15)
-    return df
 
-
-party_color = {"BN": "#2B65EC", "PH": "#E41B17", "PN": "#659EC7"}
+party_color = {
+    "BN": "#2B65EC",
+    "PH": "#E41B17",
+    "PN": "#659EC7",
+    "GPS": "#F2A900",
+    "GRS": "#00A86B",
+    "WARISAN": "#1CA9C9",
+}
 
 
 def highlight_party(val):
     return "background-color: {}".format(party_color.get(val))
 
 
-def get_party(x):
-    PN_LIST = ["PR-PAS", "GS-PAS", "PH-PPBM", "BA-PAS"]
-    PH_LIST = ["PH-DAP", "PH-PKR", "PH-PAN", "PR-DAP", "PR-PKR", "BA-PKR"]
-    if x in PN_LIST:
-        return "PN"
-    if x in PH_LIST:
-        return "PH"
-    x = x.split("-")[0]
-    if x == "BN":
-        return "BN"
-    else:
-        return None
-
-
-pdf = pd.read_csv("data/malay_parameters.csv")
-para_data = {}
-for k, v in pdf.set_index("state").iterrows():
-    para_data[k] = v.to_dict()
-
 races = ["Malay", "Chinese", "Indian", "Others"]
 
 GE14_voter_cols = [
@@ -60,147 +124,307 @@ GE15_voter_cols = [
     "GE15_{}_ratio".format(i) for i in ["malay", "chinese", "indian", "others"]
 ]
 
-adf = load_data()
-df = adf[~adf["state"].isin(["Sarawak", "Sabah", "W.P. Labuan"])].copy()
-gdf = load_data_GE15()
 
-ag_df = gdf.melt(
-    id_vars=["state", "parlimen"],
-    value_vars=[i for i in gdf.columns if any(x in i for x in ["male", "female"])],
-    var_name="age_group",
-)
-ag_df["gender"] = ag_df["age_group"].map(lambda x: x.split("_", 1)[0].strip())
-ag_df["age_group"] = ag_df["age_group"].map(lambda x: x.split("_", 1)[1])
 
-# v2_tab, v1_tab = st.tabs(["V2", "V1"])
+def start_timing(**fields):
+    """Start the timing run of this script run or fragment rerun."""
+    ctx = get_script_run_ctx()
+    session = ctx.session_id if ctx is not None else None
+    st.session_state["timing"] = new_run(session=session, **fields)
 
-###############
-# create tabs #
-###############
-tab_estimated_result, tab_descriptive_analysis, tab_age_group = st.tabs(
-    ["Estimated Result", "Descriptive Analysis", "Age Group Analysis"]
-)
 
+def fragment_rerun():
+    ctx = get_script_run_ctx()
+    return ctx is not None and bool(ctx.fragment_ids_this_run)
 
-def generate_state(df, state):
-    data = {}
-    # with v2_tab:
-    my_expander = st.expander(label="Turnout", expanded=False)
-    with my_expander:
-        para = [("Malay", 80), ("Chinese", 86), ("Indian", 88), ("Others", 80)]
-        st_cols = st.columns(len(para))
-        for k, v in enumerate(st_cols):
-            data["{}_{}_turnout".format(state, races[k])] = v.number_input(
-                "{} {} Turnout".format(state, races[k]), 0, 100, para[k][1], 1
-            )
 
-    my_expander = st.expander(label="BN Support", expanded=True)
-    with my_expander:
-        para = [("Malay", 27), ("Chinese", 15), ("Indian", 25), ("Others", 40)]
-        st_cols = st.columns(len(para))
-        for k, v in enumerate(st_cols):
-            data["{}_BN_{}_support".format(state, races[k])] = v.number_input(
-                "{} {} Support".format(state, races[k]),
-                0,
-                100,
-                int(para_data[state]["BN_{}_support".format(races[k])]),
-                1,
-            )
+def timed(name, **fields):
+    """Time a stage of the current run, see `timing.stage`."""
+    return stage(st.session_state["timing"], name, **fields)
 
-    my_expander = st.expander(label="PH Support", expanded=True)
-    with my_expander:
-        para = [("Malay", 19), ("Chinese", 80), ("Indian", 70), ("Others", 30)]
-        st_cols = st.columns(len(para))
-        for k, v in enumerate(st_cols):
-            data["{}_PH_{}_support".format(state, races[k])] = v.number_input(
-                "{} PH {} Support".format(state, races[k]),
-                0,
-                100,
-                int(para_data[state]["PH_{}_support".format(races[k])]),
-                1,
-            )
-
-    my_expander = st.expander(label="PN Support", expanded=True)
-    with my_expander:
-        para = [("Malay", 31), ("Chinese", 5), ("Indian", 5), ("Others", 30)]
-        st_cols = st.columns(len(para))
-        for k, v in enumerate(st_cols):
-            data["{}_PN_{}_support".format(state, races[k])] = v.number_input(
-                "{} PN {} Support".format(state, races[k]),
-                0,
-                100,
-                int(para_data[state]["PN_{}_support".format(races[k])]),
-                1,
-            )
 
-    my_expander = st.expander(label="Safe Threshold", expanded=False)
-    with my_expander:
-        data[f"{state}_safe_threshold"] = st.slider(
-            f"{state} Safe Threshold: percentage of majority - percentage of new voters increase",
-            -100,
-            100,
-            -100,
+def show_timings():
+    if debug:
+        timing_panel.dataframe(
+            timings_frame(st.session_state["timing"]), use_container_width=True
         )
 
-    my_expander = st.expander(label="Safe Combo", expanded=False)
-    with my_expander:
-        data[f"{state}_safe_combo"] = st.multiselect(
-            f"{state} Safe Combo", options=["2004", "2008", "2013", "2018"], default=[],
-        )
 
-    for i in ["BN", "PH", "PN"]:
-        df[i] = (
-            data[f"{state}_Malay_turnout"]
-            * data[f"{state}_{i}_Malay_support"]
-            * df["GE15_malay_voters"]
-            / 10000
-            + data[f"{state}_Chinese_turnout"]
-            * data[f"{state}_{i}_Chinese_support"]
-            * df["GE15_chinese_voters"]
-            / 10000
-            + data[f"{state}_Indian_turnout"]
-            * data[f"{state}_{i}_Indian_support"]
-            * df["GE15_indian_voters"]
-            / 10000
-            + data[f"{state}_Others_turnout"]
-            * data[f"{state}_{i}_Others_support"]
-            * df["GE15_others_voters"]
-            / 10000
+start_timing()
+with timed("load_data") as record:
+    dataset = load_dataset(
+        tuple(
+            source_signature(i)
+            for i in [DATA_PATH, DATA_PATH_GE15] + REGION_PARAMETERS_PATHS
+        )
+        + (
+            source_signature(OVERRIDES_PATH)
+            if os.path.exists(OVERRIDES_PATH)
+            else None,
         )
+    )
+    record["rows"] = len(dataset["adf"])
+adf = dataset["adf"]
+df = dataset["df"]
+gdf = dataset["gdf"]
+para_data = dataset["para_data"]
+
+# v2_tab, v1_tab = st.tabs(["V2", "V1"])
+
+lazy = st.sidebar.checkbox(
+    "Render only the selected view",
+    value=True,
+    help="Estimated Result reruns as one section: with this off, editing one "
+    "state redraws every state's chart and table (only the edited state is "
+    "re-projected).",
+)
+paginate = st.sidebar.checkbox("Paginate seat tables", value=True)
+debug = st.sidebar.checkbox("Show timings", value=False)
+timing_panel = st.sidebar.empty()
+SEAT_TABLE_PAGE_SIZE = 50
+
+seat_table_front_cols = [
+    "##",
+    "state",
+    "constituency",
+    "2004",
+    "2008",
+    "2013",
+    "2018",
+    "base_party",
+    "estimate_party",
+    *party_color,
+    "party",
+    "GE14_registered_voters",
+    "GE15_registered_voters",
+    "registered_voters_increase_pct",
+    "GE14_majority_pct",
+    "safe_threshold",
+    "registered_voters_increase",
+    "GE14_majority",
+    "GE14_malay_ratio",
+    "GE15_malay_ratio",
+    "GE14_chinese_ratio",
+    "GE15_chinese_ratio",
+    "GE14_indian_ratio",
+    "GE15_indian_ratio",
+    "GE14_others_ratio",
+    "GE15_others_ratio",
+    "GE14_malay_voters",
+    "GE15_malay_voters",
+    "GE14_chinese_voters",
+    "GE15_chinese_voters",
+    "GE14_indian_voters",
+    "GE15_indian_voters",
+    "GE14_others_voters",
+    "GE15_others_voters",
+]
+seat_table_gradients = [
+    ("registered_voters_increase_pct", "Oranges"),
+    ("GE14_majority_pct", "Greens"),
+    ("safe_threshold", "Blues"),
+]
 
-    df["estimate_party"] = df[["BN", "PH", "PN"]].idxmax(axis=1)
 
-    df["safe_threshold"] = (
-        df["GE14_majority_pct"] - df["registered_voters_increase_pct"]
+def gradient_css(values, cmap, vmin, vmax):
+    """
+    CSS of `values` shaded on `cmap` between `vmin` and `vmax` (scalars, or
+    arrays broadcasting against `values`), with light text on dark cells, as
+    `Styler.background_gradient` writes it.
+    """
+    values = np.asarray(values, dtype=np.float64)
+    span = np.asarray(vmax, dtype=np.float64) - vmin
+    with np.errstate(divide="ignore", invalid="ignore"):
+        scaled = np.where(span > 0, (values - vmin) / span, 0.0)
+    # NaN cells take the colormap's "bad" colour, as in pandas
+    rgba = matplotlib.colormaps[cmap](np.where(np.isnan(values), np.nan, scaled))
+    rgb = rgba[..., :3]
+    linear = np.where(rgb <= 0.04045, rgb / 12.92, ((rgb + 0.055) / 1.055) ** 2.4)
+    dark = linear @ np.array([0.2126, 0.7152, 0.0722]) < 0.408
+    hex_ = np.round(rgb * 255).astype(int)
+    hex_ = np.char.add(
+        "#",
+        np.char.add(
+            np.char.mod("%02x", hex_[..., 0]),
+            np.char.add(
+                np.char.mod("%02x", hex_[..., 1]), np.char.mod("%02x", hex_[..., 2])
+            ),
+        ),
     )
+    text = np.where(dark, "#f1f1f1", "#000000")
+    return np.char.add(
+        np.char.add("background-color: ", hex_), np.char.add("; color: ", text)
+    ).astype(object)
 
-    for i in ["2004", "2008", "2013", "2018"]:
-        df[f"{i}_party"] = df[i].map(get_party)
 
-    if data[f"{state}_safe_combo"]:
-        df["base"] = (
-            df[[f"{i}_party" for i in data[f"{state}_safe_combo"]]].nunique(axis=1) == 1
-        )
-        df["base"] = df["base"] & (
-            df["safe_threshold"] >= data[f"{state}_safe_threshold"]
+@st.cache_data(show_spinner=False, max_entries=256)
+def seat_table_css(key, _tdf, _bounds):
+    """
+    Per-cell CSS of a seat table, cached on the content `key`: party colours,
+    a gradient across each row's race ratios, whole-table gradients for
+    `seat_table_gradients` and the leading party's votes highlighted.
+    """
+    css = pd.DataFrame("", index=_tdf.index, columns=_tdf.columns, dtype=object)
+    css["party"] = [highlight_party(v) for v in _tdf["party"]]
+    # the race ratio gradient runs along each row
+    ratio_cols = GE14_voter_cols + GE15_voter_cols
+    ratios = _tdf[ratio_cols].to_numpy(np.float64)
+    css[ratio_cols] = gradient_css(
+        ratios,
+        "Blues",
+        np.nanmin(ratios, axis=1, keepdims=True),
+        np.nanmax(ratios, axis=1, keepdims=True),
+    )
+    for col, cmap in seat_table_gradients:
+        css[col] = gradient_css(_tdf[col].to_numpy(), cmap, *_bounds[col])
+    votes = _tdf[list(party_color)]
+    best = votes.eq(votes.max(axis=1), axis=0).to_numpy()
+    css[list(party_color)] = np.where(best, "background-color: #AAF0D1", "")
+    return css
+
+
+def seat_table(df, page=None):
+    """
+    Styled seat table, or one `SEAT_TABLE_PAGE_SIZE` page of it. Gradients
+    and highlights are only computed for rows and columns not seen before.
+    """
+    rearrange_cols = seat_table_front_cols + [
+        i for i in df.columns if i not in seat_table_front_cols
+    ]
+    tdf = df[rearrange_cols].set_index(["##", "state", "constituency"])
+    int_types = ["int16", "int32", "int64"]
+    float_types = ["float16", "float32", "float64"]
+    num_cols = tdf.select_dtypes(include=int_types + float_types).columns
+    bounds = {col: (tdf[col].min(), tdf[col].max()) for col, _ in seat_table_gradients}
+    if page is not None:
+        tdf = tdf.iloc[page * SEAT_TABLE_PAGE_SIZE : (page + 1) * SEAT_TABLE_PAGE_SIZE]
+
+    key = "{}:{}".format(
+        hashlib.sha1(pd.util.hash_pandas_object(tdf).to_numpy()).hexdigest(),
+        repr((list(tdf.columns), bounds)),
+    )
+    css = seat_table_css(key, tdf, bounds)
+    return tdf.style.format({i: "{:,.0f}" for i in num_cols}).apply(
+        lambda _: css, axis=None
+    )
+
+
+def render_seat_table(df, key):
+    page = None
+    if paginate and len(df) > SEAT_TABLE_PAGE_SIZE:
+        n_pages = -(-len(df) // SEAT_TABLE_PAGE_SIZE)
+        page = (
+            st.number_input(f"Page (of {n_pages})", 1, n_pages, 1, key=f"{key}_page")
+            - 1
         )
-        sname = "{}_party".format(data[f"{state}_safe_combo"][-1])
-        df["base_party"] = df[["base", sname]].apply(
-            lambda x: x[sname] if x["base"] else None, axis=1,
+    st.dataframe(seat_table(df, page), use_container_width=True, height=800)
+
+
+def view_containers(views, key):
+    """
+    A tab per view, or in lazy mode a selector and a container for the
+    selected view only; the other views map to None and are not rendered.
+    """
+    if not lazy:
+        return dict(zip(views, st.tabs(views)))
+    selected = st.radio(key, views, horizontal=True, label_visibility="collapsed")
+    return {view: st.container() if view == selected else None for view in views}
+
+
+def state_input(key, default, widget=None, *args, **kwargs):
+    """
+    Value of the input `key`, drawn with `widget(*args, key=key, **kwargs)`
+    when a widget is given. The value survives reruns where the widget is not
+    drawn, and resets when `default` changes, as an unkeyed widget would.
+    """
+    inputs = st.session_state.setdefault("inputs", {})
+    value, seen_default = inputs.get(key, (default, default))
+    if key in st.session_state:
+        value = st.session_state[key]
+    if seen_default != default:
+        value = default
+    # a loaded scenario's value counts as an edit made under today's default
+    loaded = st.session_state.get("loaded_inputs", {})
+    if key in loaded:
+        value = loaded.pop(key)
+    if widget:
+        st.session_state[key] = value
+        value = widget(*args, key=key, **kwargs)
+    inputs[key] = (value, default)
+    return value
+
+
+def generate_state_inputs(state, para_data, render=True):
+    data = {}
+
+    def inputs_row(label, expanded):
+        if not render:
+            return [None] * len(races)
+        return st.expander(label=label, expanded=expanded).columns(len(races))
+
+    # with v2_tab:
+    st_cols = inputs_row("Turnout", False)
+    for k, v in enumerate(st_cols):
+        key = "{}_{}_turnout".format(state, races[k])
+        data[key] = state_input(
+            key,
+            int(parameter_turnout(para_data[state])[races[k]]),
+            v and v.number_input,
+            "{} {} Turnout".format(state, races[k]),
+            0,
+            100,
+            step=1,
         )
-    else:
-        df["base"] = False
-        df["base_party"] = None
 
-    for k, v in hard_base_party.items():
-        df.loc[df["constituency"].isin(v), "base_party"] = k
+    support_labels = {
+        "BN": "{} {} Support",
+        "PH": "{} PH {} Support",
+        "PN": "{} PN {} Support",
+    }
+    standing = standing_parties(para_data[state])
+    for party in party_color:
+        if party not in standing:
+            # not standing in this state's region: no votes, and no inputs
+            for race in races:
+                data[f"{state}_{party}_{race}_support"] = 0
+            continue
+        label = support_labels.get(party, "{} " + party + " {} Support")
+        st_cols = inputs_row(f"{party} Support", True)
+        for k, v in enumerate(st_cols):
+            key = "{}_{}_{}_support".format(state, party, races[k])
+            data[key] = state_input(
+                key,
+                int(para_data[state]["{}_{}_support".format(party, races[k])]),
+                v and v.number_input,
+                label.format(state, races[k]),
+                0,
+                100,
+                step=1,
+            )
+
+    key = f"{state}_safe_threshold"
+    data[key] = state_input(
+        key,
+        -100,
+        render and st.expander(label="Safe Threshold", expanded=False).slider,
+        f"{state} Safe Threshold: percentage of majority - percentage of new voters increase",
+        -100,
+        100,
+    )
+
+    key = f"{state}_safe_combo"
+    data[key] = state_input(
+        key,
+        [],
+        render and st.expander(label="Safe Combo", expanded=False).multiselect,
+        f"{state} Safe Combo",
+        options=["2004", "2008", "2013", "2018"],
+    )
 
-    df["party"] = df["base_party"].fillna(df["estimate_party"])
+    return data
 
-    int_types = ["int16", "int32", "int64"]
-    float_types = ["float16", "float32", "float64"]
-    num_cols = df.select_dtypes(include=int_types + float_types).columns
 
+def generate_state(df, state):
     tab_chart, tab_data = st.tabs(["Chart", "Data"])
 
     with tab_chart:
@@ -275,117 +499,34 @@ def generate_state(df, state):
     #     )
 
     with tab_data:
-        front_cols = [
-            "##",
-            "state",
-            "constituency",
-            "2004",
-            "2008",
-            "2013",
-            "2018",
-            "base_party",
-            "estimate_party",
-            "BN",
-            "PH",
-            "PN",
-            "party",
-            "GE14_registered_voters",
-            "GE15_registered_voters",
-            "registered_voters_increase_pct",
-            "GE14_majority_pct",
-            "safe_threshold",
-            "registered_voters_increase",
-            "GE14_majority",
-            "GE14_malay_ratio",
-            "GE15_malay_ratio",
-            "GE14_chinese_ratio",
-            "GE15_chinese_ratio",
-            "GE14_indian_ratio",
-            "GE15_indian_ratio",
-            "GE14_others_ratio",
-            "GE15_others_ratio",
-            "GE14_malay_voters",
-            "GE15_malay_voters",
-            "GE14_chinese_voters",
-            "GE15_chinese_voters",
-            "GE14_indian_voters",
-            "GE15_indian_voters",
-            "GE14_others_voters",
-            "GE15_others_voters",
-        ]
-        rearrange_cols = front_cols + [i for i in df.columns if i not in front_cols]
-        st.dataframe(
-            df[rearrange_cols]
-            .set_index(["##", "state", "constituency"])
-            .style.format({i: "{:,.0f}" for i in num_cols})
-            .applymap(highlight_party, subset=["party"])
-            .background_gradient(
-                subset=GE14_voter_cols + GE15_voter_cols, cmap="Blues", axis=1
-            )
-            .background_gradient(
-                subset="registered_voters_increase_pct", cmap="Oranges", axis=0
-            )
-            .background_gradient(subset="GE14_majority_pct", cmap="Greens", axis=0)
-            .background_gradient(subset="safe_threshold", cmap="Blues", axis=0)
-            .highlight_max(subset=["BN", "PH", "PN"], color="#AAF0D1", axis=1),
-            use_container_width=True,
-            height=800,
-        )
+        render_seat_table(df, state)
 
         return df
 
 
 def run_state(df, state, tab):
-    with tab:
-        st.subheader(state)
+    with tab, timed("generate_state", state=state, rows=len(df)):
         df = generate_state(df, state)
     return df
 
 
-with tab_estimated_result:
-    hard_base_party = {}
-    hard_base_party["BN"] = st.multiselect(
-        "Hard Rule BN",
-        df["constituency"].unique(),
-        default=[
-            "Sungai Buloh (previously known as Subang)[3]",
-            "Kepala Batas",
-            "Tasek Gelugor",
-            "Tanjong Karang",
-        ],
-    )
-    hard_base_party["PH"] = st.multiselect(
-        "Hard Rule PH", df["constituency"].unique(), default=[]
-    )
-    hard_base_party["PN"] = st.multiselect(
-        "Hard Rule PN",
-        df["constituency"].unique(),
-        default=["Arau", "Sabak Bernam", "Putrajaya"],
-    )
-
-    undecided_malay = {}
-    undecided_malay["BN"] = st.slider("undecided Malays to BN", 0, 100, 30, 5)
-    undecided_malay["PH"] = st.slider("undecided Malays to PH", 0, 100, 30, 5)
-    undecided_malay["PN"] = st.slider("undecided Malays to PN", 0, 100, 40, 5)
-
-    for state in para_data.keys():
-        for party in undecided_malay.keys():
-            para_data[state][f"{party}_Malay_support"] = (
-                para_data[state][f"{party}_Malay_support"]
-                + undecided_malay[party] * para_data[state]["unsure"] / 100
-            )
-
-    states = df["state"].unique().tolist()
-    state_tabs = st.tabs(states)
-
-    state_df_list = [
-        run_state(df[df["state"] == state], state, tab)
-        for state, tab in zip(states, state_tabs)
-    ]
-    ndf = pd.concat(state_df_list)
-
-    tab_national_chart, tab_national_data, = st.tabs(
-        ["National Chart", "National Data"]
+def render_national(ndf, data, states):
+    (
+        tab_national_chart,
+        tab_national_data,
+        tab_national_simulation,
+        tab_national_flips,
+        tab_national_solver,
+        tab_national_duns,
+    ) = st.tabs(
+        [
+            "National Chart",
+            "National Data",
+            "National Simulation",
+            "Flip Index",
+            "Majority Solver",
+            "State Assembly",
+        ]
     )
     with tab_national_chart:
         st.subheader("Estimated National Result")
@@ -419,101 +560,490 @@ with tab_estimated_result:
         )
 
         st.altair_chart(chart, use_container_width=True)
-        nsdf = (
-            ndf.groupby(["state", "party"])
-            .size()
-            .reset_index()
-            .pivot_table(index=["state"], columns=["party"])
-        )
-        nsdf.columns = [b for a, b in nsdf.columns]
-        nsdf = nsdf.fillna(0).astype(int)
-        st.dataframe(nsdf, height=530)
+        with timed("national_pivot", rows=len(ndf)):
+            nsdf = (
+                ndf.groupby(["state", "party"], observed=True)
+                .size()
+                .reset_index()
+                .pivot_table(index=["state"], columns=["party"])
+            )
+            nsdf.columns = [b for a, b in nsdf.columns]
+            nsdf = nsdf.fillna(0).astype(int)
+            st.dataframe(nsdf, height=530)
 
     with tab_national_data:
-        front_cols = [
-            "##",
-            "state",
-            "constituency",
-            "2004",
-            "2008",
-            "2013",
-            "2018",
-            "base_party",
-            "estimate_party",
-            "BN",
-            "PH",
-            "PN",
-            "party",
-            "GE14_registered_voters",
-            "GE15_registered_voters",
-            "registered_voters_increase_pct",
-            "GE14_majority_pct",
-            "safe_threshold",
-            "registered_voters_increase",
-            "GE14_majority",
-            "GE14_malay_ratio",
-            "GE15_malay_ratio",
-            "GE14_chinese_ratio",
-            "GE15_chinese_ratio",
-            "GE14_indian_ratio",
-            "GE15_indian_ratio",
-            "GE14_others_ratio",
-            "GE15_others_ratio",
-            "GE14_malay_voters",
-            "GE15_malay_voters",
-            "GE14_chinese_voters",
-            "GE15_chinese_voters",
-            "GE14_indian_voters",
-            "GE15_indian_voters",
-            "GE14_others_voters",
-            "GE15_others_voters",
-        ]
-        int_types = ["int16", "int32", "int64"]
-        float_types = ["float16", "float32", "float64"]
-        num_cols = ndf.select_dtypes(include=int_types + float_types).columns
-        rearrange_cols = front_cols + [i for i in ndf.columns if i not in front_cols]
+        render_seat_table(ndf, "National")
+
+    with tab_national_simulation:
+        sim_cols = st.columns(3)
+        n_draws = sim_cols[0].number_input("Draws", 10000, 1000000, 100000, 10000)
+        turnout_sd = sim_cols[1].number_input("Turnout Spread", 0.0, 20.0, 3.0, 0.5)
+        support_sd = sim_cols[2].number_input("Support Spread", 0.0, 20.0, 3.0, 0.5)
+        if st.checkbox("Run Simulation", value=False):
+            sim = simulate(
+                ndf,
+                data,
+                states,
+                n=n_draws,
+                turnout_sd=turnout_sd,
+                support_sd=support_sd,
+                base_party=ndf["base_party"],
+                overrides=dataset["overrides"],
+            )
+            st.subheader("P(majority >= 112)")
+            st.dataframe(
+                sim["majority_prob"].to_frame("probability").T.style.format(
+                    "{:.2%}"
+                )
+            )
+            hdf = sim["histogram"].reset_index().melt(
+                id_vars=["seats"], var_name="party", value_name="draws"
+            )
+            hdf = hdf[hdf["draws"] > 0]
+            chart = (
+                alt.Chart(hdf, title="Simulated Seat Distribution")
+                .mark_bar(opacity=0.7)
+                .encode(
+                    alt.X("seats:Q"),
+                    alt.Y("draws:Q", stack=None),
+                    alt.Color(
+                        "party",
+                        scale=alt.Scale(
+                            domain=list(party_color.keys()),
+                            range=list(party_color.values()),
+                        ),
+                    ),
+                    alt.Tooltip(["party", "seats", "draws"]),
+                )
+                .properties(height=400)
+            )
+            st.altair_chart(chart, use_container_width=True)
+            st.subheader("Seat Win Probability")
+            st.dataframe(
+                sim["win_prob"]
+                .style.format("{:.1%}")
+                .background_gradient(cmap="Greens", axis=None),
+                use_container_width=True,
+                height=800,
+            )
+
+    with tab_national_flips:
+        fidx = flip_index(
+            ndf,
+            data,
+            states,
+            base_party=ndf["base_party"],
+            overrides=dataset["overrides"],
+        )
+        st.subheader("Most Marginal Seats")
+        st.dataframe(marginal_seats(fidx, 20), use_container_width=True)
+
+        st.subheader("What Flips")
+        flip_cols = st.columns(4)
+        flip_party = flip_cols[0].selectbox("Party", list(party_color.keys()))
+        flip_race = flip_cols[1].selectbox("Race", ["All"] + races)
+        flip_state = flip_cols[2].selectbox("State", ["Malaysia"] + states)
+        flip_shift = flip_cols[3].number_input("Support Shift", -100, 100, 3, 1)
         st.dataframe(
-            ndf[rearrange_cols]
-            .set_index(["##", "state", "constituency"])
-            .style.format({i: "{:,.0f}" for i in num_cols})
-            .applymap(highlight_party, subset=["party"])
-            .background_gradient(
-                subset=GE14_voter_cols + GE15_voter_cols, cmap="Blues", axis=1
+            flips(
+                fidx,
+                flip_party,
+                flip_shift,
+                race=None if flip_race == "All" else flip_race,
+                state=None if flip_state == "Malaysia" else flip_state,
+            ),
+            use_container_width=True,
+        )
+
+    with tab_national_solver:
+        solve_cols = st.columns(4)
+        solve_party = solve_cols[0].selectbox(
+            "Party", list(party_color.keys()), index=1, key="solve_party"
+        )
+        solve_target_seats = solve_cols[1].number_input("Seat Target", 1, 222, 112, 1)
+        solve_lever = solve_cols[2].selectbox("Lever", ["support", "turnout"])
+        solve_race = solve_cols[3].selectbox(
+            "Race", ["All"] + races, index=1, key="solve_race"
+        )
+        solve_cols = st.columns(4)
+        solve_from = solve_cols[0].selectbox(
+            "Taken From",
+            ["None"] + [p for p in party_color if p != solve_party],
+            disabled=solve_lever != "support",
+        )
+        solve_mode = solve_cols[1].selectbox("Mode", ["uniform", "per_state"])
+        solve_max = solve_cols[2].number_input("Max Shift", 1, 100, 20, 1)
+        # default to the states where the party, and the one it takes
+        # support from, both stand
+        solve_standing = [solve_party]
+        if solve_lever == "support" and solve_from != "None":
+            solve_standing.append(solve_from)
+        standing = [
+            s
+            for s in states
+            if all(
+                any(data[f"{s}_{party}_{r}_support"] for r in races)
+                for party in solve_standing
             )
-            .background_gradient(
-                subset="registered_voters_increase_pct", cmap="Oranges", axis=0
+        ]
+        solve_states = solve_cols[3].multiselect(
+            "States",
+            states,
+            default=standing,
+            key=f"solve_states_{'_'.join(solve_standing)}",
+        )
+        with timed("solve_target", rows=len(ndf)):
+            solution = solve_target(
+                ndf,
+                data,
+                states,
+                solve_party,
+                target=solve_target_seats,
+                lever=solve_lever,
+                race=None if solve_race == "All" else solve_race,
+                from_party=None if solve_from == "None" else solve_from,
+                mode=solve_mode,
+                bounds=(-solve_max, solve_max),
+                allowed_states=solve_states,
+                base_party=ndf["base_party"],
+                overrides=dataset["overrides"],
+            )
+        if solution["feasible"]:
+            st.success(
+                f"{solve_party}: {solution['seats_before']} -> "
+                f"{solution['seats']} seats, {solution['votes']:,.0f} votes moved"
             )
-            .background_gradient(subset="GE14_majority_pct", cmap="Greens", axis=0)
-            .background_gradient(subset="safe_threshold", cmap="Blues", axis=0)
-            .highlight_max(subset=["BN", "PH", "PN"], color="#AAF0D1", axis=1),
+        else:
+            st.warning(
+                f"{solve_target_seats} seats is out of reach within these bounds; "
+                f"the closest change gives {solve_party} {solution['seats']} seats"
+            )
+        st.dataframe(
+            pd.Series(solution["shifts"], dtype=float).to_frame("shift (points)"),
+            use_container_width=True,
+        )
+
+    with tab_national_duns:
+        duns = project_duns(
+            gdf, ndf, data, states, overrides=dataset["overrides"]
+        )
+        rollup = roll_up_duns(duns)
+        st.subheader("Estimated State Assembly Seats")
+        st.caption(
+            "Each DUN takes its parlimen's race mix, so it goes to the party "
+            "projected for its parlimen; safe-seat and hard-rule calls are not "
+            "applied to DUNs. Federal territories have no state assembly."
+        )
+        st.dataframe(rollup["state"].drop(columns=list(party_color)), height=530)
+        st.subheader("State Assembly Data")
+        st.dataframe(
+            duns.style.format({party: "{:,.0f}" for party in party_color})
+            .applymap(highlight_party, subset=["estimate_party"])
+            .highlight_max(subset=list(party_color), color="#AAF0D1", axis=1),
             use_container_width=True,
             height=800,
         )
 
-with tab_descriptive_analysis:
 
-    tdf1 = get_table1(adf, gdf)
-    st.subheader("New Registered Voters by States")
-    st.table(tdf1)
+def load_saved_scenario(name):
+    scenario = load_scenario(name)
+    if scenario is None:
+        return
+    loaded = dict(scenario["data"])
+    for party, value in scenario["undecided_malay"].items():
+        loaded[f"undecided_malay_{party}"] = value
+    for party, value in scenario["hard_base_party"].items():
+        loaded[f"hard_rule_{party}"] = value
+    model = scenario.get("age_turnout")
+    st.session_state["age_turnout"] = model is not None
+    for rates in (model or {}).values():
+        for band, value in rates.items():
+            loaded[f"age_turnout_{band}"] = value
+    st.session_state["loaded_inputs"] = loaded
+
+
+def seat_frame(model=None):
+    """`df`, with the age-aware turnout `model`'s factors when one is given."""
+    if model is None:
+        return df
+    factor = turnout_factor(
+        gdf, df, dataset["parlimen_index"], model["age"], model["votertype"]
+    )
+    return pd.concat([df, factor], axis=1)
+
+
+def render_age_turnout():
+    """The age-aware turnout model's rates, or None when it is switched off."""
+    if not st.checkbox("Use age-aware turnout", key="age_turnout"):
+        return None
+    model = {}
+    for kind, defaults in [
+        ("age", default_age_turnout),
+        ("votertype", default_votertype_turnout),
+    ]:
+        model[kind] = {}
+        cols = st.columns(len(defaults))
+        for col, (band, default) in zip(cols, defaults.items()):
+            model[kind][band] = state_input(
+                f"age_turnout_{band}",
+                default,
+                col.number_input,
+                f"{band} turnout",
+                0,
+                100,
+                step=1,
+            )
+    return model
+
+
+def scenario_result(scenario, states):
+    """Seat counts and seat calls of `scenario`, from the store when cached."""
+    key = scenario_hash(scenario, dataset["version"])
+    result = cached_result(key)
+    if result is None:
+        state_dfs = project_states(
+            seat_frame(scenario.get("age_turnout")),
+            scenario["data"],
+            states,
+            scenario["hard_base_party"],
+            cache=dataset["state_cache"],
+            history=dataset["history"],
+            overrides=dataset["overrides"],
+        )
+        result = store_result(key, pd.concat([state_dfs[s] for s in states]))
+    return result
+
+
+def render_scenarios(scenario, ndf, states):
+    save_col, load_col, compare_col = st.columns(3)
+    name = save_col.text_input("Scenario name")
+    if save_col.button("Save scenario", disabled=not name):
+        save_scenario(name, scenario)
+        store_result(scenario_hash(scenario, dataset["version"]), ndf)
+        save_col.success(f"Saved {name}")
+
+    saved = list_scenarios()
+    selected = load_col.selectbox("Saved scenario", saved)
+    load_col.button(
+        "Load scenario",
+        on_click=load_saved_scenario,
+        args=(selected,),
+        disabled=selected is None,
+    )
+    load_col.button(
+        "Delete scenario",
+        on_click=delete_scenario,
+        args=(selected,),
+        disabled=selected is None,
+    )
+
+    compare = compare_col.multiselect("Compare seats with", saved)
+    if compare:
+        seats = {"Current": ndf["party"].value_counts().to_dict()}
+        for other in compare:
+            seats[other] = scenario_result(load_scenario(other), states)[0]
+        cdf = pd.DataFrame(seats).T.reindex(columns=list(party_color))
+        compare_col.dataframe(cdf.fillna(0).astype(int))
+
+
+def default_result(states):
+    """Seat calls under the dashboard defaults, from the shared state cache."""
+    state_dfs = project_states(
+        df,
+        scenario_data(para_data, states, default_undecided_malay),
+        states,
+        default_hard_base_party,
+        cache=dataset["state_cache"],
+        history=dataset["history"],
+        overrides=dataset["overrides"],
+    )
+    return compact_result(pd.concat([state_dfs[s] for s in states]))
+
+
+def render_changes(ndf, states):
+    current = compact_result(ndf)
+    baseline_col, pin_col = st.columns([3, 1])
+    baseline = baseline_col.selectbox(
+        "Baseline", ["Defaults", "Pinned"] + list_scenarios()
+    )
+    if pin_col.button("Pin current as baseline"):
+        st.session_state["pinned_result"] = current
+
+    if baseline == "Defaults":
+        before = default_result(states)
+    elif baseline == "Pinned":
+        before = st.session_state.get("pinned_result")
+        if before is None:
+            st.info("Pin a projection to compare against it.")
+            return
+    else:
+        before = compact_result(scenario_result(load_scenario(baseline), states)[1])
+
+    try:
+        diff = seat_diff(before, current)
+    except ValueError as e:
+        # a baseline pinned before the dataset changed
+        st.warning(f"Cannot compare against this baseline: {e}")
+        return
+    st.write(f"{len(diff)} seats changed hands")
+    if len(diff):
+        st.dataframe(
+            diff.style.format(
+                {
+                    i: "{:,.0f}"
+                    for i in diff.columns
+                    if i.startswith("margin") or i.endswith(("swing", "_change"))
+                }
+            ).applymap(highlight_party, subset=["from", "to"]),
+            use_container_width=True,
+        )
+
+
+# Each section is a fragment: editing an input reruns only its own section, so
+# a turnout or support change never touches the descriptive or age group
+# views, and within Estimated Result only the edited state is re-projected.
+@st.fragment
+def render_estimated_result():
+    if fragment_rerun():
+        start_timing(section="Estimated Result")
+    summary = st.container()
+    scenario_box = st.expander("Scenarios", expanded=False)
+    changes_box = st.expander("Changes since baseline", expanded=False)
+    with st.expander("Age-aware turnout", expanded=False):
+        st.caption(
+            "Regular voters turn out at their age band's rate, early and postal "
+            "voters at their voter type's. Each race's growth in voters since "
+            "GE14 turns out at the rate of the youngest bands."
+        )
+        age_model = render_age_turnout()
+    seat_df = seat_frame(age_model)
+
+    hard_base_party = {}
+    for party in parties:
+        hard_base_party[party] = state_input(
+            f"hard_rule_{party}",
+            default_hard_base_party.get(party, []),
+            st.multiselect,
+            f"Hard Rule {party}",
+            df["constituency"].unique(),
+        )
+
+    undecided_malay = {}
+    for party, default in default_undecided_malay.items():
+        undecided_malay[party] = state_input(
+            f"undecided_malay_{party}",
+            default,
+            st.slider,
+            f"undecided Malays to {party}",
+            0,
+            100,
+            step=5,
+        )
+
+    state_para = apply_undecided(para_data, undecided_malay)
+
+    states = df["state"].unique().tolist()
+    if lazy:
+        views = view_containers(states + ["National"], "Estimated Result View")
+    else:
+        views = dict(zip(states, st.tabs(states)))
+        views["National"] = st.container()
+
+    data = {}
+    for state in states:
+        if views[state] is None:
+            data.update(generate_state_inputs(state, state_para, render=False))
+            continue
+        with views[state]:
+            st.subheader(state)
+            data.update(generate_state_inputs(state, state_para))
+
+    with timed("project_states", rows=len(df)):
+        state_dfs = project_states(
+            seat_df,
+            data,
+            states,
+            hard_base_party,
+            cache=dataset["state_cache"],
+            history=dataset["history"],
+            overrides=dataset["overrides"],
+        )
+    for state in states:
+        if views[state] is not None:
+            run_state(state_dfs[state], state, views[state])
+    with timed("national_concat") as record:
+        ndf = pd.concat([state_dfs[state] for state in states])
+        record["rows"] = len(ndf)
+
+    scenario = {
+        "data": data,
+        "undecided_malay": undecided_malay,
+        "hard_base_party": hard_base_party,
+    }
+    if age_model is not None:
+        scenario["age_turnout"] = age_model
+    with scenario_box:
+        render_scenarios(scenario, ndf, states)
+
+    with changes_box, timed("seat_diff", rows=len(ndf)):
+        render_changes(ndf, states)
+
+    with summary:
+        seats = ndf["party"].value_counts()
+        for col, party in zip(st.columns(len(party_color)), party_color):
+            col.metric(f"{party} seats", int(seats.get(party, 0)))
+        overrides = dataset["overrides"]
+        if overrides is not None:
+            st.caption(
+                f"{len(overrides['winner']['seat'])} forced winners, "
+                f"{len(overrides['support']['seat'])} support and "
+                f"{len(overrides['turnout']['seat'])} turnout adjustments "
+                f"from {OVERRIDES_PATH}"
+            )
+
+    if views["National"] is not None:
+        with views["National"]:
+            render_national(ndf, data, states)
+    if fragment_rerun():
+        show_timings()
+
+
+@st.fragment
+def render_descriptive_analysis():
+    if fragment_rerun():
+        start_timing(section="Descriptive Analysis")
+    with timed("get_table1") as record:
+        tdf1 = get_table1(dataset["voter_cube"])
+        st.subheader("New Registered Voters by States")
+        st.table(tdf1)
+        record["rows"] = len(tdf1.data)
 
     tab1, tab2 = st.tabs(["tab1", "tab2"])
-    with tab1:
-        tdf2 = get_race_table(adf)
+    with tab1, timed("get_race_table") as record:
+        tdf2 = get_race_table(dataset["voter_cube"])
         st.subheader("New Registered Voters by States and Race")
         st.table(tdf2)
-    with tab2:
-        tdf22 = get_race_table2(adf)
+        record["rows"] = len(tdf2.data)
+    with tab2, timed("get_race_table2") as record:
+        tdf22 = get_race_table2(dataset["voter_cube"])
         st.subheader("New Registered Voters by States and Race")
         st.dataframe(tdf22, height=530)
+        record["rows"] = len(tdf22.data)
+    if fragment_rerun():
+        show_timings()
 
-with tab_age_group:
+@st.fragment
+def render_age_group():
+    if fragment_rerun():
+        start_timing(section="Age Group Analysis")
+    cube = dataset["age_cube"]
     tab_ag_state, tab_ag_parlimen, tab_ag_data, = st.tabs(["State", "Parlimen", "Data"])
 
     with tab_ag_data:
-        ag_data_df = gdf.groupby(["state", "parlimen"])[
+        ag_data_df = gdf.groupby(["state", "parlimen"], observed=True)[
             ["total"]
             + [i for i in gdf.columns if any([j for j in ["male", "female"] if j in i])]
-        ].sum()
+        ].sum().sort_index()
         ag_data_df = ag_data_df.style.background_gradient(
             subset=[
                 i for i in gdf.columns if any([j for j in ["male", "female"] if j in i])
@@ -527,25 +1057,34 @@ with tab_age_group:
     with tab_ag_state:
         state = st.multiselect(
             "state",
-            ag_df["state"].unique().tolist() + ["Malaysia"],
+            list(cube["states"]) + ["Malaysia"],
             default=["Malaysia"],
         )
-        if state:
-            for s in state:
-                if s == "Malaysia":
-                    fig = plot_age_group(ag_df.copy(), "Malaysia")
-                    st.plotly_chart(fig)
-                else:
-                    fig = plot_age_group(ag_df[ag_df["state"] == s].copy(), s)
-                    st.plotly_chart(fig)
-        else:
-            fig = plot_age_group(ag_df, "Malaysia")
-            st.plotly_chart(fig)
+        for s in state or ["Malaysia"]:
+            with timed("plot_age_group", region=s):
+                fig = age_group_figure(cube, s, dataset["figure_cache"])
+                st.plotly_chart(fig)
 
     with tab_ag_parlimen:
         parlimen = st.multiselect(
-            "parlimen", ag_df["parlimen"].unique(), default="P.001 Padang Besar"
+            "parlimen", list(cube["parlimen"]), default="P.001 Padang Besar"
         )
         for p in parlimen:
-            fig = plot_age_group(ag_df[ag_df["parlimen"] == p], p)
-            st.plotly_chart(fig)
+            with timed("plot_age_group", region=p):
+                fig = age_group_figure(cube, p, dataset["figure_cache"])
+                st.plotly_chart(fig)
+    if fragment_rerun():
+        show_timings()
+
+
+sections = {
+    "Estimated Result": render_estimated_result,
+    "Descriptive Analysis": render_descriptive_analysis,
+    "Age Group Analysis": render_age_group,
+}
+for name, container in view_containers(list(sections), "Section").items():
+    if container is not None:
+        with container:
+            sections[name]()
+
+show_timings()
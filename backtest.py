@@ -0,0 +1,227 @@
+"""
+Backtest the support baselines against GE14 and calibrate them.
+
+    python backtest.py
+    python backtest.py --calibrate -o data/calibrated_parameters.csv
+
+The backtest projects the GE14 electorate (the `GE14_{race}_voters` columns)
+under a scenario's turnout and support and scores the estimated winners
+against the recorded 2018 winners, grouped as `get_party` groups them. Seats
+won outside `engine.parties` are left out.
+
+Calibration fits per-state, per-race support and turnout to the same
+winners. Its objective is a smooth stand-in for accuracy: the cross-entropy
+of a softmax over every seat's projected vote shares, plus a penalty for
+moving away from the starting parameters, and it is minimised with
+vectorized gradient steps over all seats at once.
+"""
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from engine import (
+    GE14_race_voter_cols,
+    _state_means,
+    default_undecided_malay,
+    excluded_states,
+    load_parameters,
+    parties,
+    project,
+    races,
+    scenario_inputs,
+    state_index,
+    support_tensor,
+    voter_matrix,
+    winner_codes,
+)
+from loader import DATA_PATH, REGION_PARAMETERS_PATHS, load_new_voters
+
+
+def backtest(df, data, states, election="2018", parties=parties):
+    """
+    Estimated GE14 winners under `data` scored against `election`. Returns a
+    dict with the overall `accuracy`, per-state and per-party `by_state` and
+    `confusion` frames, and the per-seat `seats` frame.
+    """
+    actual = winner_codes(df, parties)[election].to_numpy()
+    votes, estimate = project(
+        voter_matrix(df, GE14_race_voter_cols),
+        state_index(df, states),
+        support_tensor(data, states, parties),
+    )
+    names = np.array(list(parties) + [None], dtype=object)
+    seats = df[["##", "state", "constituency"]].astype(str).reset_index(drop=True)
+    seats["actual"] = names[actual]
+    seats["estimate"] = names[estimate]
+    seats = seats[actual >= 0]
+    seats["correct"] = seats["actual"] == seats["estimate"]
+
+    by_state = seats.groupby("state", sort=False)["correct"].agg(["size", "sum"])
+    by_state.columns = ["seats", "correct"]
+    by_state["accuracy"] = by_state["correct"] / by_state["seats"]
+    confusion = pd.crosstab(seats["actual"], seats["estimate"]).reindex(
+        index=list(parties), columns=list(parties), fill_value=0
+    )
+    return {
+        "accuracy": float(seats["correct"].mean()),
+        "by_state": by_state,
+        "confusion": confusion,
+        "seats": seats.reset_index(drop=True),
+    }
+
+
+def _loss(voters, sidx, onehot, T, S, T0, S0, sharpness, prior):
+    """Objective and its gradients with respect to T and S."""
+    n = len(voters)
+    weights = T[sidx][:, None, :] * S[sidx] / 10000
+    votes = np.einsum("ir,ipr->ip", voters, weights)
+    total = votes.sum(axis=1, keepdims=True)
+    share = votes / total
+    z = sharpness * share
+    z -= z.max(axis=1, keepdims=True)
+    prob = np.exp(z)
+    prob /= prob.sum(axis=1, keepdims=True)
+    loss = -np.log(prob[onehot] + 1e-12).mean()
+
+    dz = (prob - onehot) / n
+    # through share = votes / total
+    dvotes = sharpness * (dz - (dz * share).sum(axis=1, keepdims=True)) / total
+    dS_seat = dvotes[:, :, None] * voters[:, None, :] * T[sidx][:, None, :] / 10000
+    dT_seat = (dvotes[:, :, None] * voters[:, None, :] * S[sidx] / 10000).sum(1)
+    dS = np.zeros_like(S)
+    dT = np.zeros_like(T)
+    np.add.at(dS, sidx, dS_seat)
+    np.add.at(dT, sidx, dT_seat)
+
+    # prior penalty per 10 points moved, averaged over parameters
+    loss += prior * (((S - S0) / 10) ** 2).mean() + prior * (
+        ((T - T0) / 10) ** 2
+    ).mean()
+    dS += prior * 2 * (S - S0) / 100 / S.size
+    dT += prior * 2 * (T - T0) / 100 / T.size
+    return loss, dT, dS
+
+
+def calibrate(
+    df,
+    data,
+    states,
+    election="2018",
+    steps=500,
+    learning_rate=0.5,
+    sharpness=20.0,
+    prior=1.0,
+    parties=parties,
+):
+    """
+    Per-state, per-race turnout and support fitted to the `election` winners
+    on the GE14 electorate, starting from (and pulled towards) `data`.
+    Returns a dict with the fitted `turnout` (states x races) and `support`
+    (states x parties x races) arrays, the fitted `data` dict (whole points,
+    as the dashboard inputs take) and the objective per step in `loss`.
+    """
+    actual = winner_codes(df, parties)[election].to_numpy()
+    known = actual >= 0
+    voters = voter_matrix(df, GE14_race_voter_cols)[known]
+    sidx = state_index(df, states)[known]
+    onehot = np.eye(len(parties), dtype=bool)[actual[known]]
+
+    T0, S0 = _state_means(data, states, parties)
+    T, S = T0.copy(), S0.copy()
+    # parties not standing in a state keep no support there
+    standing = S0.sum(axis=2, keepdims=True) > 0
+    # Adam, with every parameter kept within 0-100 after each step
+    m = [np.zeros_like(T), np.zeros_like(S)]
+    v = [np.zeros_like(T), np.zeros_like(S)]
+    beta1, beta2 = 0.9, 0.999
+    losses = []
+    for t in range(1, steps + 1):
+        loss, dT, dS = _loss(voters, sidx, onehot, T, S, T0, S0, sharpness, prior)
+        losses.append(loss)
+        for k, (x, g) in enumerate([(T, dT), (S, dS)]):
+            m[k] = beta1 * m[k] + (1 - beta1) * g
+            v[k] = beta2 * v[k] + (1 - beta2) * g ** 2
+            step = m[k] / (1 - beta1 ** t) / (np.sqrt(v[k] / (1 - beta2 ** t)) + 1e-12)
+            np.clip(x - learning_rate * step, 0, 100, out=x)
+        S *= standing
+
+    fitted = dict(data)
+    for s, state in enumerate(states):
+        for r, race in enumerate(races):
+            fitted[f"{state}_{race}_turnout"] = int(round(T[s, r]))
+            for p, party in enumerate(parties):
+                fitted[f"{state}_{party}_{race}_support"] = int(round(S[s, p, r]))
+    return {"turnout": T, "support": S, "data": fitted, "loss": np.array(losses)}
+
+
+def parameters_frame(data, states, parties=parties):
+    """
+    `data` in the malay_parameters.csv layout, with its turnout as
+    `{race}_turnout` columns. The support is final, so `unsure` is 0, and it
+    is left blank for parties with no support at all in a state.
+    """
+    rows = []
+    for state in states:
+        row = {"state": state}
+        standing = [
+            party
+            for party in parties
+            if any(data[f"{state}_{party}_{race}_support"] for race in races)
+        ]
+        for race in races:
+            for party in parties:
+                key = f"{state}_{party}_{race}_support"
+                row[f"{party}_{race}_support"] = (
+                    data[key] if party in standing else np.nan
+                )
+            if race == "Malay":
+                row["unsure"] = 0
+        for race in races:
+            row[f"{race}_turnout"] = data[f"{state}_{race}_turnout"]
+        rows.append(row)
+    return pd.DataFrame(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--election", default="2018")
+    parser.add_argument("--calibrate", action="store_true")
+    parser.add_argument("--steps", type=int, default=500)
+    parser.add_argument("--prior", type=float, default=1.0)
+    parser.add_argument("-o", "--output", help="calibrated parameters CSV")
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--parameters", nargs="+", default=REGION_PARAMETERS_PATHS)
+    args = parser.parse_args()
+
+    df = load_new_voters(args.data)
+    df = df[~df["state"].isin(excluded_states)].copy()
+    states = df["state"].unique().tolist()
+    data, _ = scenario_inputs(
+        {"undecided_malay": default_undecided_malay},
+        load_parameters(args.parameters),
+        states,
+    )
+
+    result = backtest(df, data, states, args.election)
+    print(f"accuracy: {result['accuracy']:.1%}")
+    if args.calibrate:
+        fit = calibrate(
+            df, data, states, args.election, steps=args.steps, prior=args.prior
+        )
+        calibrated = backtest(df, fit["data"], states, args.election)
+        by_state = result["by_state"].join(
+            calibrated["by_state"]["accuracy"].rename("calibrated")
+        )
+        print(f"calibrated accuracy: {calibrated['accuracy']:.1%}")
+        print(by_state.to_string(float_format="{:.1%}".format))
+        print(calibrated["confusion"].to_string())
+        if args.output:
+            parameters_frame(fit["data"], states).to_csv(args.output, index=False)
+    else:
+        print(result["by_state"].to_string(float_format="{:.1%}".format))
+        print(result["confusion"].to_string())
+
+
+if __name__ == "__main__":
+    main()
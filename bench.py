@@ -0,0 +1,247 @@
+"""
+Benchmarks for the dashboard's hot paths, run without a browser.
+
+    python bench.py --scale 1 10 100
+    python bench.py --save-baseline bench_baseline.json
+    python bench.py --fail-over 1.25
+
+Each case is timed over `--repeat` runs (after one warm-up) and once more
+under tracemalloc for its peak memory. Scales above 1 replicate every seat
+and DUN of the bundled data that many times, under new codes and names, so
+the projection and tables see 10x / 100x the seats. Results are compared
+with the stored baseline when there is one.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from engine import (
+    default_hard_base_party,
+    excluded_states,
+    load_parameters,
+    project_duns,
+    project_states,
+    roll_up_duns,
+    scenario_data,
+    winner_codes,
+)
+from loader import load_new_voters, load_voters_ge15
+from plot import (
+    age_cube,
+    age_genders,
+    age_pyramid,
+    get_race_table,
+    get_race_table2,
+    get_table1,
+    plot_age_group,
+    voter_cube,
+)
+
+BASELINE_PATH = "bench_baseline.json"
+
+
+def _renumber(labels, copy):
+    """Seat numbers in `labels`, offset past the originals for copy `copy`."""
+    number = labels.str.extract(r"(\d+)", expand=False).astype(int)
+    return number + copy * 1000
+
+
+def scaled_dataset(scale=1):
+    """
+    The bundled data with every parlimen and DUN repeated `scale` times. Copies
+    get parlimen numbers offset by multiples of 1000 and suffixed names, so
+    they stay distinct seats of the same states.
+    """
+    adf = load_new_voters()
+    gdf = load_voters_ge15()
+    if scale > 1:
+        adfs, gdfs = [], []
+        codes = adf["##"].astype(str)
+        labels = gdf["parlimen"].astype(str)
+        for copy in range(scale):
+            a = adf.copy()
+            g = gdf.copy()
+            if copy:
+                number = _renumber(codes, copy)
+                a["##"] = "P" + number.astype(str).str.zfill(3)
+                a["constituency"] = a["constituency"].astype(str) + f" #{copy}"
+                number = _renumber(labels, copy)
+                g["parlimen"] = (
+                    "P."
+                    + number.astype(str).str.zfill(3)
+                    + labels.str.replace(r"^P\.\d+", "", regex=True)
+                    + f" #{copy}"
+                )
+                g["dun"] = g["dun"].astype(str) + f" #{copy}"
+            adfs.append(a.astype({"##": str, "constituency": str}))
+            gdfs.append(g.astype({"parlimen": str, "dun": str}))
+        adf = pd.concat(adfs, ignore_index=True)
+        gdf = pd.concat(gdfs, ignore_index=True)
+        for col in ["constituency", "parlimen", "dun"]:
+            frame = adf if col in adf else gdf
+            frame[col] = frame[col].astype("category")
+    df = adf[~adf["state"].isin(excluded_states)].copy()
+    states = df["state"].unique().tolist()
+    return {
+        "adf": adf,
+        "df": df,
+        "gdf": gdf,
+        "states": states,
+        "data": scenario_data(load_parameters(), states),
+        "history": winner_codes(df),
+    }
+
+
+def bench_cases(dataset):
+    """{case: zero-argument callable} over one `scaled_dataset`."""
+    df, gdf, states, data = (dataset[k] for k in ["df", "gdf", "states", "data"])
+    cube = voter_cube(dataset["adf"], gdf)
+    ages = age_cube(gdf)
+    parlimen = list(ages["parlimen"])[:30]
+
+    def tables():
+        for table in [get_table1(cube), get_race_table(cube), get_race_table2(cube)]:
+            table.to_html()
+
+    return {
+        "project_states": lambda: project_states(
+            df, data, states, default_hard_base_party, history=dataset["history"]
+        ),
+        "project_duns": lambda: roll_up_duns(project_duns(gdf, df, data, states)),
+        "voter_cube": lambda: voter_cube(dataset["adf"], gdf),
+        "descriptive_tables": tables,
+        "age_cube": lambda: age_cube(gdf),
+        "plot_age_group": lambda: [
+            plot_age_group(ages, name) for name in ["Malaysia"] + parlimen
+        ],
+    }
+
+
+def check_age_cube(gdf):
+    """Raise if any state or parlimen pyramid differs from a groupby sum."""
+    cube = age_cube(gdf)
+    cols = [f"{g}_{b}" for g in age_genders for b in cube["bands"]]
+    shape = (len(age_genders), len(cube["bands"]))
+    for level, names in [("state", cube["states"]), ("parlimen", cube["parlimen"])]:
+        sums = gdf.groupby(gdf[level].astype(str))[cols].sum()
+        wrong = [
+            name
+            for name in sums.index
+            if name not in names
+            or not np.array_equal(
+                age_pyramid(cube, name), sums.loc[name].to_numpy().reshape(shape)
+            )
+        ]
+        if wrong:
+            raise RuntimeError(
+                f"age_cube: {len(wrong)} of {len(sums)} {level} pyramids differ "
+                f"from the groupby sum, e.g. {wrong[0]}"
+            )
+
+
+def rerun_case():
+    """A full headless run of app.py, with the dataset already loaded."""
+    from streamlit.testing.v1 import AppTest
+
+    def rerun():
+        at = AppTest.from_file("app.py", default_timeout=600)
+        at.run()
+        if at.exception:
+            raise RuntimeError(at.exception[0].message)
+
+    return rerun
+
+
+def measure(fn, repeat=5):
+    """Median and min latency in ms, and peak traced memory in MB."""
+    fn()
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - start) * 1000)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {
+        "median_ms": float(np.median(times)),
+        "min_ms": float(np.min(times)),
+        "peak_mb": peak / 2**20,
+    }
+
+
+def run(scales=(1, 10), repeat=5, cases=None, rerun=True):
+    """Benchmark results, one row per (case, scale)."""
+    rows = []
+    for scale in scales:
+        dataset = scaled_dataset(scale)
+        check_age_cube(dataset["gdf"])
+        scale_cases = bench_cases(dataset)
+        if rerun and scale == 1:
+            # app.py always reads the bundled data
+            scale_cases["rerun"] = rerun_case()
+        for name, fn in scale_cases.items():
+            if cases and name not in cases:
+                continue
+            rows.append({"case": name, "scale": scale, **measure(fn, repeat)})
+    return pd.DataFrame(rows)
+
+
+def compare(result, baseline):
+    """`result` with the baseline's median latency and peak memory alongside."""
+    base = pd.DataFrame(baseline)
+    if base.empty:
+        return result
+    base = base.set_index(["case", "scale"])[["median_ms", "peak_mb"]]
+    base.columns = ["baseline_ms", "baseline_mb"]
+    out = result.join(base, on=["case", "scale"])
+    out["ratio"] = out["median_ms"] / out["baseline_ms"]
+    return out
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--scale", type=int, nargs="+", default=[1, 10])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--case", action="append", help="run only these cases")
+    parser.add_argument("--no-rerun", action="store_true", help="skip the app rerun")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", metavar="PATH")
+    parser.add_argument(
+        "--fail-over",
+        type=float,
+        metavar="RATIO",
+        help="exit 1 if any case is this many times slower than the baseline",
+    )
+    args = parser.parse_args()
+
+    result = run(args.scale, args.repeat, args.case, rerun=not args.no_rerun)
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(result.to_dict(orient="records"), f, indent=1)
+
+    baseline = []
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    result = compare(result, baseline)
+    print(result.to_string(index=False, float_format="{:,.2f}".format))
+
+    if args.fail_over and "ratio" in result:
+        slow = result[result["ratio"] > args.fail_over]
+        if len(slow):
+            print(f"slower than {args.fail_over}x baseline: {', '.join(slow['case'])}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1128 @@
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+from loader import REGION_PARAMETERS_PATHS, load_parameters_frame
+
+races = ["Malay", "Chinese", "Indian", "Others"]
+# every party of every region; a region's parameters file has support columns
+# for the parties standing there, and the others get no votes in its seats
+parties = ["BN", "PH", "PN", "GPS", "GRS", "WARISAN"]
+elections = ["2004", "2008", "2013", "2018"]
+# every state has parameters now, so none are left out of the projection
+excluded_states = []
+
+default_turnout = {"Malay": 80, "Chinese": 86, "Indian": 88, "Others": 80}
+default_safe_threshold = -100
+default_undecided_malay = {"BN": 30, "PH": 30, "PN": 40}
+default_hard_base_party = {
+    "BN": [
+        "Sungai Buloh (previously known as Subang)[3]",
+        "Kepala Batas",
+        "Tasek Gelugor",
+        "Tanjong Karang",
+    ],
+    "PH": [],
+    "PN": ["Arau", "Sabak Bernam", "Putrajaya"],
+    "GPS": [],
+    "GRS": [],
+    "WARISAN": [],
+}
+
+# turnout (%) of the age-aware turnout model: regular voters by age band,
+# early and postal voters by voter type
+default_age_turnout = {
+    "18_20": 65,
+    "21_29": 72,
+    "30_39": 78,
+    "40_49": 82,
+    "50_59": 85,
+    "60_69": 85,
+    "70_79": 78,
+    "80_89": 62,
+    "90+": 40,
+}
+default_votertype_turnout = {"early_a": 95, "early_b": 95, "postal_overseas": 55}
+# age bands of the voters registered since GE14, mostly Undi18 registrations
+default_new_voter_bands = ("18_20", "21_29")
+
+GE15_race_voter_cols = ["GE15_{}_voters".format(i.lower()) for i in races]
+GE14_race_voter_cols = ["GE14_{}_voters".format(i.lower()) for i in races]
+turnout_factor_cols = [f"{race}_turnout_factor" for race in races]
+
+
+def get_party(x):
+    PN_LIST = ["PR-PAS", "GS-PAS", "PH-PPBM", "BA-PAS"]
+    PH_LIST = ["PH-DAP", "PH-PKR", "PH-PAN", "PR-DAP", "PR-PKR", "BA-PKR", "BN-UPKO"]
+    # Sarawak's BN parties became GPS; PBS, STAR and SAPP are in GRS
+    GPS_LIST = ["BN-PBB", "BN-PRS", "BN-PBDS", "BN-PDP", "BN-SPDP", "BN-SUPP"]
+    GRS_LIST = ["BN-PBS", "USA-STAR", "BN-SAPP"]
+    if x in PN_LIST:
+        return "PN"
+    if x in PH_LIST:
+        return "PH"
+    if x in GPS_LIST:
+        return "GPS"
+    if x in GRS_LIST:
+        return "GRS"
+    if x == "WARISAN":
+        return "WARISAN"
+    if not isinstance(x, str):
+        # no recorded winner, e.g. a seat created after that election
+        return None
+    x = x.split("-")[0]
+    if x == "BN":
+        return "BN"
+    else:
+        return None
+
+
+def load_parameters(paths=REGION_PARAMETERS_PATHS):
+    """
+    `para_data` dict of state -> parameters row, from one parameters file or
+    a list of region files laid out like malay_parameters.csv. A row has
+    support values only for the parties standing in its region; a blank
+    cell means the party does not stand in that state. A state may only
+    appear in one file.
+    """
+    para_data = {}
+    for path in [paths] if isinstance(paths, str) else paths:
+        pdf = load_parameters_frame(path)
+        unknown = sorted(
+            {c.split("_")[0] for c in pdf.columns if c.endswith("_support")}
+            - set(parties)
+        )
+        if unknown:
+            raise ValueError(f"{path}: parties {unknown} are not in engine.parties")
+        states = pdf["state"].astype(str)
+        repeated = set(states[states.duplicated()]) | (set(states) & set(para_data))
+        if repeated:
+            raise ValueError(f"{path}: states {sorted(repeated)} have parameters twice")
+        for k, v in pdf.set_index("state").iterrows():
+            para_data[k] = v.dropna().to_dict()
+    return para_data
+
+
+def standing_parties(parameters, parties=parties):
+    """The parties with support columns in one state's parameters."""
+    return [p for p in parties if f"{p}_{races[0]}_support" in parameters]
+
+
+def parameter_turnout(parameters):
+    """
+    Turnout per race for one state's parameters: the `{race}_turnout`
+    columns of a calibrated parameters file, else `default_turnout`.
+    """
+    return {
+        race: parameters.get(f"{race}_turnout", default_turnout[race])
+        for race in races
+    }
+
+
+def apply_undecided(para_data, undecided_malay):
+    """Copy of `para_data` with the unsure Malays split by `undecided_malay`."""
+    para_data = {k: dict(v) for k, v in para_data.items()}
+    for state in para_data.keys():
+        for party in undecided_malay.keys():
+            if f"{party}_Malay_support" not in para_data[state]:
+                continue
+            para_data[state][f"{party}_Malay_support"] = (
+                para_data[state][f"{party}_Malay_support"]
+                + undecided_malay[party] * para_data[state]["unsure"] / 100
+            )
+    return para_data
+
+
+def scenario_data(
+    para_data,
+    states,
+    undecided_malay=None,
+    turnout=None,
+    safe_threshold=None,
+    safe_combo=None,
+):
+    """
+    The `data` dict generate_state_inputs builds when its widgets are left at
+    their defaults. `turnout`, `safe_threshold` and `safe_combo` may be a
+    single value for every state or a dict keyed by state.
+    """
+    if undecided_malay is not None:
+        para_data = apply_undecided(para_data, undecided_malay)
+
+    def per_state(value, state, default):
+        if isinstance(value, dict) and state in value:
+            return value[state]
+        # a dict keyed by other states leaves this one at the default; a
+        # turnout dict keyed by race applies to every state
+        if value is None or (isinstance(value, dict) and set(value) & set(states)):
+            return default
+        return value
+
+    data = {}
+    for state in states:
+        # races left out of a turnout dict keep the state's default
+        default = parameter_turnout(para_data[state])
+        state_turnout = {**default, **per_state(turnout, state, default)}
+        for race in races:
+            data[f"{state}_{race}_turnout"] = state_turnout[race]
+        for party in parties:
+            for race in races:
+                data[f"{state}_{party}_{race}_support"] = int(
+                    para_data[state].get(f"{party}_{race}_support", 0)
+                )
+        data[f"{state}_safe_threshold"] = per_state(
+            safe_threshold, state, default_safe_threshold
+        )
+        data[f"{state}_safe_combo"] = list(per_state(safe_combo, state, []))
+    return data
+
+
+def scenario_inputs(scenario, para_data, states):
+    """
+    `data` and `hard_base_party` for a scenario dict with any of the keys
+    `para_data`, `undecided_malay`, `hard_base_party`, `turnout`, `support`,
+    `safe_threshold` and `safe_combo`. Missing keys, and parties missing from
+    `undecided_malay` / `hard_base_party`, take the dashboard defaults.
+    `support` overrides final support values per state, e.g.
+    {"Kedah": {"PN_Malay": 45}}, as the support sliders do.
+    """
+    undecided_malay = {
+        **default_undecided_malay,
+        **scenario.get("undecided_malay", {}),
+    }
+    hard_base_party = {
+        **default_hard_base_party,
+        **scenario.get("hard_base_party", {}),
+    }
+    data = scenario_data(
+        scenario.get("para_data", para_data),
+        states,
+        undecided_malay=undecided_malay,
+        turnout=scenario.get("turnout"),
+        safe_threshold=scenario.get("safe_threshold"),
+        safe_combo=scenario.get("safe_combo"),
+    )
+    for state, values in scenario.get("support", {}).items():
+        for name, value in values.items():
+            key = f"{state}_{name}_support"
+            if key not in data:
+                raise KeyError(key)
+            data[key] = value
+    return data, hard_base_party
+
+
+def winner_codes(df, parties=parties):
+    """
+    (seats x elections) int8 frame of `get_party` winners as indices into
+    `parties`, -1 where the winner is in none of them. Built once per dataset.
+    """
+    labels = pd.Index(parties)
+    codes = {
+        i: labels.get_indexer(df[i].map(get_party).astype(object)).astype(np.int8)
+        for i in elections
+    }
+    return pd.DataFrame(codes, index=df.index)
+
+
+def safe_seats(codes, safe_threshold, safe_combo, threshold):
+    """
+    Safe-seat mask and base party codes (-1 for none) from a winner code
+    matrix. A seat is safe when every `safe_combo` election with a known
+    winner went to the same party and its safe threshold is at least
+    `threshold`; its base party is the winner of the last election in the
+    combo.
+    """
+    n = len(codes)
+    if not safe_combo:
+        return np.zeros(n, dtype=bool), np.full(n, -1, dtype=np.int8)
+    sel = codes[:, [elections.index(i) for i in safe_combo]]
+    known = sel >= 0
+    hi = np.where(known, sel, np.iinfo(np.int8).min).max(axis=1)
+    lo = np.where(known, sel, np.iinfo(np.int8).max).min(axis=1)
+    base = known.any(axis=1) & (hi == lo) & (safe_threshold >= threshold)
+    return base, np.where(base, sel[:, -1], -1).astype(np.int8)
+
+
+def apply_base_party(
+    df, state, data, hard_base_party, history=None, parties=parties, overrides=None
+):
+    """
+    Safe-seat, override and hard-rule winners for one state's projected
+    seats, and the final `party` call. `history` is `winner_codes` for the
+    full dataset; the hard rules win over the forced winners of `overrides`.
+    """
+    df = df.copy()
+    df["safe_threshold"] = (
+        df["GE14_majority_pct"] - df["registered_voters_increase_pct"]
+    )
+
+    codes = winner_codes(df, parties) if history is None else history.loc[df.index]
+    codes = codes[elections].to_numpy()
+    # code -1 picks the trailing None
+    names = np.array(list(parties) + [None], dtype=object)
+    for k, i in enumerate(elections):
+        df[f"{i}_party"] = names[codes[:, k]]
+
+    base, base_party = safe_seats(
+        codes,
+        df["safe_threshold"].to_numpy(),
+        data[f"{state}_safe_combo"],
+        data[f"{state}_safe_threshold"],
+    )
+    df["base"] = base
+    if overrides is not None:
+        rows, codes = override_winners(df.index, overrides)
+        base_party[rows] = codes
+    df["base_party"] = names[base_party]
+
+    for k, v in hard_base_party.items():
+        df.loc[df["constituency"].isin(v), "base_party"] = k
+
+    df["party"] = df["base_party"].fillna(df["estimate_party"])
+    return df
+
+
+def voter_matrix(df, cols=GE15_race_voter_cols):
+    """
+    (seats x races) GE15 voter counts, or GE14 with `GE14_race_voter_cols`,
+    scaled by the age-aware turnout model's `turnout_factor_cols` when `df`
+    has them.
+    """
+    voters = df[cols].to_numpy(dtype=np.float64)
+    if set(turnout_factor_cols) <= set(df.columns):
+        voters *= df[turnout_factor_cols].to_numpy(dtype=np.float64)
+    return voters
+
+
+def state_index(df, states):
+    """Position of every seat's state in `states`."""
+    return pd.Index(states).get_indexer(df["state"])
+
+
+def support_tensor(data, states, parties=parties):
+    """
+    (states x parties x races) turnout * support fractions from a `data` dict
+    keyed like generate_state's inputs, e.g. "Perak_Malay_turnout" and
+    "Perak_BN_Malay_support".
+    """
+    tensor = np.zeros((len(states), len(parties), len(races)))
+    for s, state in enumerate(states):
+        for p, party in enumerate(parties):
+            for r, race in enumerate(races):
+                tensor[s, p, r] = (
+                    data[f"{state}_{race}_turnout"]
+                    * data[f"{state}_{party}_{race}_support"]
+                    / 10000
+                )
+    return tensor
+
+
+def project(voters, sidx, tensor):
+    """
+    Estimated votes (seats x parties) and the index of the leading party for
+    every seat, in one batched product.
+    """
+    votes = np.einsum("sr,spr->sp", voters, tensor[sidx])
+    return votes, votes.argmax(axis=1)
+
+
+def project_frame(df, data, states, parties=parties, overrides=None):
+    """
+    Copy of `df` with estimated party votes and `estimate_party` filled in,
+    including the support and turnout deltas of `overrides`.
+    """
+    voters = voter_matrix(df)
+    sidx = state_index(df, states)
+    votes, winner = project(voters, sidx, support_tensor(data, states, parties))
+    if overrides is not None:
+        turnout, support = _state_means(data, states, parties)
+        votes = override_votes(
+            votes, df.index, voters, sidx, turnout, support, overrides
+        )
+        winner = votes.argmax(axis=1)
+    df = df.copy()
+    for k, party in enumerate(parties):
+        df[party] = votes[:, k]
+    df["estimate_party"] = np.array(parties, dtype=object)[winner]
+    return df
+
+
+def project_seats(df, data, states, hard_base_party, history=None, overrides=None):
+    """Full per-seat projection, as the Estimated Result tabs show it."""
+    return pd.concat(
+        project_states(
+            df, data, states, hard_base_party, history=history, overrides=overrides
+        ).values()
+    )
+
+
+def project_batch(
+    df, datas, states, hard_base_parties, history=None, parties=parties, overrides=None
+):
+    """
+    Seat calls for many scenarios in one pass: the `data` dicts in `datas`
+    and their `hard_base_parties`, with `overrides` applied to every one.
+    Returns (scenarios x seats x parties) votes and (scenarios x seats) codes
+    into `parties` for `estimate_party`, `base_party` (-1 for none) and the
+    final `party`, in `df` row order.
+    """
+    if history is None:
+        history = winner_codes(df, parties)
+    voters = voter_matrix(df)
+    sidx = state_index(df, states)
+    tensors = np.stack([support_tensor(data, states, parties) for data in datas])
+    votes = np.einsum("sr,bspr->bsp", voters, tensors[:, sidx])
+    if overrides is not None:
+        means = [_state_means(data, states, parties) for data in datas]
+        votes = override_votes(
+            votes,
+            df.index,
+            voters,
+            sidx,
+            np.stack([turnout for turnout, _ in means]),
+            np.stack([support for _, support in means]),
+            overrides,
+        )
+    estimate = votes.argmax(axis=2)
+
+    codes = history.loc[df.index, elections].to_numpy()
+    margin = (
+        df["GE14_majority_pct"] - df["registered_voters_increase_pct"]
+    ).to_numpy()
+    constituency = df["constituency"]
+    base = np.full(estimate.shape, -1, dtype=np.int8)
+    forced = override_winners(df.index, overrides) if overrides is not None else None
+    for b, (data, hard_base_party) in enumerate(zip(datas, hard_base_parties)):
+        # states sharing a safe combo are one safe_seats call
+        thresholds = np.array([data[f"{s}_safe_threshold"] for s in states])
+        combos = {}
+        for s, state in enumerate(states):
+            combos.setdefault(tuple(data[f"{state}_safe_combo"]), []).append(s)
+        for combo, combo_states in combos.items():
+            rows = np.isin(sidx, combo_states)
+            _, base[b, rows] = safe_seats(
+                codes[rows], margin[rows], list(combo), thresholds[sidx[rows]]
+            )
+        if forced is not None:
+            base[b, forced[0]] = forced[1]
+        for party, seats in hard_base_party.items():
+            base[b, constituency.isin(seats).to_numpy()] = parties.index(party)
+    party = np.where(base >= 0, base, estimate)
+    return votes, estimate, base, party
+
+
+def state_inputs(data, state, parties=parties):
+    """The slice of `data` that generate_state_inputs builds for `state`."""
+    keys = [f"{state}_{race}_turnout" for race in races]
+    keys += [
+        f"{state}_{party}_{race}_support" for party in parties for race in races
+    ]
+    keys += [f"{state}_safe_threshold", f"{state}_safe_combo"]
+    return tuple((k, data[k]) for k in keys)
+
+
+def state_key(
+    data,
+    state,
+    hard_base_party,
+    constituencies,
+    parties=parties,
+    factors=None,
+    overrides=None,
+):
+    """
+    Hash of everything a state's seat calls depend on; `factors` is a hash
+    of its seats' `turnout_factor_cols` and `overrides` the key of the seat
+    overrides, if any.
+    """
+    hard = tuple(
+        sorted(
+            (party, c)
+            for party, v in hard_base_party.items()
+            for c in v
+            if c in constituencies
+        )
+    )
+    key = repr(
+        (
+            state,
+            state_inputs(data, state, parties),
+            hard,
+            tuple(parties),
+            factors,
+            overrides,
+        )
+    )
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def project_states(
+    df,
+    data,
+    states,
+    hard_base_party,
+    cache=None,
+    max_entries=512,
+    history=None,
+    parties=parties,
+    overrides=None,
+):
+    """
+    `project_seats` split by state, reusing the frames in `cache` for states
+    whose inputs and hard-rule seats are unchanged. Returns {state: frame}.
+    The cached frames are shared between calls and must not be modified.
+    """
+    if history is None:
+        history = winner_codes(df, parties)
+    if cache is None:
+        cache = {}
+    constituencies = df.groupby("state", observed=True)["constituency"].agg(set)
+    factors = {}
+    if set(turnout_factor_cols) <= set(df.columns):
+        codes = df["state"].astype(str).to_numpy()
+        values = df[turnout_factor_cols].to_numpy(dtype=np.float64)
+        factors = {
+            state: hashlib.sha1(values[codes == state].tobytes()).hexdigest()
+            for state in states
+        }
+    keys = {
+        state: state_key(
+            data,
+            state,
+            hard_base_party,
+            constituencies[state],
+            parties,
+            factors.get(state),
+            None if overrides is None else overrides["key"],
+        )
+        for state in states
+    }
+    # pop-and-reinsert keeps the cache in LRU order and tolerates other
+    # sessions touching the same cache: a lost race only costs a recompute
+    frames = {}
+    for state in states:
+        frame = cache.pop(keys[state], None)
+        if frame is not None:
+            frames[state] = frame
+    stale = [state for state in states if state not in frames]
+    if stale:
+        sdf = project_frame(
+            df[df["state"].isin(stale)], data, stale, parties, overrides
+        )
+        for state in stale:
+            frames[state] = apply_base_party(
+                sdf[sdf["state"] == state],
+                state,
+                data,
+                hard_base_party,
+                history=history,
+                parties=parties,
+                overrides=overrides,
+            )
+    for state in states:
+        cache[keys[state]] = frames[state]
+    while len(cache) > max_entries:
+        try:
+            cache.pop(next(iter(cache)), None)
+        except (StopIteration, RuntimeError):
+            break
+    return frames
+
+
+def compile_overrides(frame, df, parties=parties):
+    """
+    Sparse per-seat overrides from a seat overrides frame, one adjustment
+    per row: `##` and either `winner` (a forced winner), `party`, `race` and
+    `support` (a support delta in points) or `race` and `turnout` (a turnout
+    delta). A blank race means every race. Seats are `df.index` labels, and
+    each kind is kept as parallel arrays:
+
+    winner   {"seat", "party"}
+    support  {"seat", "party", "race", "delta"}
+    turnout  {"seat", "race", "delta"}
+    key      content hash, part of the state cache keys
+    """
+    frame = frame.copy()
+    for col in ["winner", "party", "race", "support", "turnout"]:
+        if col not in frame:
+            frame[col] = np.nan
+    seat = pd.Index(df["##"].astype(str)).get_indexer(frame["##"].astype(str))
+    if (seat < 0).any():
+        missing = sorted(set(frame["##"].astype(str)[seat < 0]))
+        raise ValueError(f"overrides for seats not in df: {missing}")
+    frame["seat"] = df.index.to_numpy()[seat]
+
+    for col, labels in [("winner", parties), ("party", parties), ("race", races)]:
+        unknown = sorted(set(frame[col].dropna().astype(str)) - set(labels))
+        if unknown:
+            raise ValueError(f"unknown {col} in overrides: {unknown}")
+
+    def by_race(rows):
+        # a blank race is one row per race
+        rows = rows.assign(race=rows["race"].astype(object))
+        blank = rows["race"].isna()
+        every = rows[blank].loc[rows[blank].index.repeat(len(races))]
+        every["race"] = races * int(blank.sum())
+        rows = pd.concat([rows[~blank], every])
+        return rows, pd.Index(races).get_indexer(rows["race"].astype(str))
+
+    winners = frame[frame["winner"].notna()]
+    support, support_race = by_race(frame[frame["support"].notna()])
+    turnout, turnout_race = by_race(frame[frame["turnout"].notna()])
+    if support["party"].isna().any():
+        raise ValueError("support overrides need a party")
+    key = hashlib.sha1(
+        frame.to_csv(index=False).encode() + repr(list(parties)).encode()
+    ).hexdigest()
+    return {
+        "winner": {
+            "seat": winners["seat"].to_numpy(np.int64),
+            "party": pd.Index(parties)
+            .get_indexer(winners["winner"].astype(str))
+            .astype(np.int8),
+        },
+        "support": {
+            "seat": support["seat"].to_numpy(np.int64),
+            "party": pd.Index(parties).get_indexer(support["party"].astype(str)),
+            "race": support_race,
+            "delta": support["support"].to_numpy(np.float64),
+        },
+        "turnout": {
+            "seat": turnout["seat"].to_numpy(np.int64),
+            "race": turnout_race,
+            "delta": turnout["turnout"].to_numpy(np.float64),
+        },
+        "key": key,
+    }
+
+
+def override_winners(index, overrides):
+    """(positions in `index`, party codes) of the forced winners among `index`."""
+    rows = index.get_indexer(overrides["winner"]["seat"])
+    found = rows >= 0
+    return rows[found], overrides["winner"]["party"][found]
+
+
+def _override_deltas(index, overrides, n_parties, n_races):
+    """
+    Positions in `index` of the seats `overrides` adjusts, with their (k x
+    races) turnout and (k x parties x races) support deltas.
+    """
+    s_rows = index.get_indexer(overrides["support"]["seat"])
+    t_rows = index.get_indexer(overrides["turnout"]["seat"])
+    s_found, t_found = s_rows >= 0, t_rows >= 0
+    seats = np.unique(np.concatenate([s_rows[s_found], t_rows[t_found]]))
+    d_support = np.zeros((len(seats), n_parties, n_races))
+    np.add.at(
+        d_support,
+        (
+            np.searchsorted(seats, s_rows[s_found]),
+            overrides["support"]["party"][s_found],
+            overrides["support"]["race"][s_found],
+        ),
+        overrides["support"]["delta"][s_found],
+    )
+    d_turnout = np.zeros((len(seats), n_races))
+    np.add.at(
+        d_turnout,
+        (
+            np.searchsorted(seats, t_rows[t_found]),
+            overrides["turnout"]["race"][t_found],
+        ),
+        overrides["turnout"]["delta"][t_found],
+    )
+    return seats, d_turnout, d_support
+
+
+def _add_deltas(votes, voters, sidx, turnout, support, seats, d_turnout, d_support):
+    """`votes` with the deltas of `_override_deltas` added at `seats`."""
+    T = turnout[..., sidx[seats], :]
+    S = support[..., sidx[seats], :, :]
+    new = np.clip(T + d_turnout, 0, 100)[..., None, :] * np.clip(S + d_support, 0, 100)
+    change = (new - T[..., None, :] * S) / 10000
+    votes = votes.copy()
+    votes[..., seats, :] += np.einsum("kr,...kpr->...kp", voters[seats], change)
+    return votes
+
+
+def override_votes(votes, index, voters, sidx, turnout, support, overrides):
+    """
+    `votes` with the support and turnout deltas of `overrides` for the seats
+    in `index` added, as one scatter over just those seats. `turnout` and
+    `support` are the (... x states x races) and (... x states x parties x
+    races) inputs; leading batch axes match those of `votes`.
+    """
+    seats, d_turnout, d_support = _override_deltas(
+        index, overrides, support.shape[-2], support.shape[-1]
+    )
+    if not len(seats):
+        return votes
+    return _add_deltas(
+        votes, voters, sidx, turnout, support, seats, d_turnout, d_support
+    )
+
+
+def seat_inputs(index, sidx, turnout, support, overrides=None):
+    """
+    (seats x races) turnout and (seats x parties x races) support of the
+    seats in `index`: their state's inputs with the deltas of `overrides`.
+    """
+    T, S = turnout[sidx], support[sidx]
+    if overrides is not None:
+        seats, d_turnout, d_support = _override_deltas(
+            index, overrides, support.shape[1], support.shape[2]
+        )
+        T[seats] = np.clip(T[seats] + d_turnout, 0, 100)
+        S[seats] = np.clip(S[seats] + d_support, 0, 100)
+    return T, S
+
+
+def seat_counts(df, parties=parties):
+    """Seats won per party from a `project_seats` frame."""
+    return df["party"].value_counts().reindex(parties, fill_value=0)
+
+
+def compact_result(df, parties=parties):
+    """
+    The arrays `seat_diff` compares, from a projected frame (or a stored
+    result with the same columns): seat labels, (seats x parties) votes and
+    `party` codes into `parties`.
+    """
+    return {
+        "##": df["##"].astype(str).to_numpy(),
+        "state": df["state"].astype(str).to_numpy(),
+        "constituency": df["constituency"].astype(str).to_numpy(),
+        "votes": df[parties].to_numpy(dtype=np.float64),
+        "party": pd.Index(parties).get_indexer(df["party"]).astype(np.int8),
+    }
+
+
+def _margin(votes, codes):
+    """Votes of party `codes` over the best other party, per row."""
+    rows = np.arange(len(codes))
+    others = votes.copy()
+    others[rows, codes] = -np.inf
+    return votes[rows, codes] - others.max(axis=1)
+
+
+def seat_diff(before, after, parties=parties):
+    """
+    Seats whose `party` differs between two `compact_result`s, in `after`'s
+    seat order: the party each went from and to, the margin each held it by
+    (votes over the next best party), the swing between the two and every
+    party's change in votes. Raises ValueError when `after` has seats that
+    `before` lacks.
+    """
+    if not np.array_equal(before["##"], after["##"]):
+        order = pd.Index(before["##"]).get_indexer(after["##"])
+        if (order < 0).any():
+            missing = list(np.asarray(after["##"])[order < 0])
+            raise ValueError(f"seats missing from the baseline: {missing}")
+        before = {k: v[order] for k, v in before.items()}
+    rows = np.flatnonzero(before["party"] != after["party"])
+    votes_before, votes_after = before["votes"][rows], after["votes"][rows]
+    was, now = before["party"][rows], after["party"][rows]
+    names = np.array(parties, dtype=object)
+    k = np.arange(len(rows))
+
+    out = pd.DataFrame(
+        {
+            "##": after["##"][rows],
+            "state": after["state"][rows],
+            "constituency": after["constituency"][rows],
+            "from": names[was],
+            "to": names[now],
+            "margin_before": _margin(votes_before, was),
+            "margin_after": _margin(votes_after, now),
+            # how far the new party closed on the old one
+            "swing": (votes_after[k, now] - votes_after[k, was])
+            - (votes_before[k, now] - votes_before[k, was]),
+        }
+    )
+    change = votes_after - votes_before
+    for p, party in enumerate(parties):
+        out[f"{party}_change"] = change[:, p]
+    return out
+
+
+def parlimen_code(labels):
+    """
+    new_voters "##" codes for voters_ge15 parlimen labels, e.g. "P001" for
+    "P.001 Padang Besar".
+    """
+    labels = pd.Categorical(labels)
+    codes = pd.Series(labels.categories.astype(str)).str.replace(
+        r"^P\.(\d+).*$", r"P\1", regex=True
+    )
+    return codes.to_numpy(dtype=object)[labels.codes]
+
+
+def parlimen_index(gdf, df):
+    """
+    Row in `df` of every DUN's parlimen, -1 where `df` has no such seat.
+    Built once per dataset, so joining DUN figures onto seats is an array
+    gather rather than a string merge.
+    """
+    return pd.Index(df["##"].astype(str)).get_indexer(parlimen_code(gdf["parlimen"]))
+
+
+def dun_voter_matrix(gdf, df, pidx=None):
+    """
+    (DUNs x races) GE15 voters and the position of each DUN's parlimen in
+    `df`. DUNs take their own `GE15_{race}_voters` columns when `gdf` has
+    them; otherwise each parlimen's race voters are split over its DUNs in
+    proportion to their totals, so the DUNs add up to their parlimen.
+    """
+    if pidx is None:
+        pidx = parlimen_index(gdf, df)
+    if (pidx < 0).any():
+        missing = sorted(set(gdf["parlimen"].astype(str).to_numpy()[pidx < 0]))
+        raise ValueError(f"parlimen without a seat in df: {missing}")
+    if set(GE15_race_voter_cols) <= set(gdf.columns):
+        return gdf[GE15_race_voter_cols].to_numpy(dtype=np.float64), pidx
+    total = gdf["total"].to_numpy(dtype=np.float64)
+    weight = total / np.bincount(pidx, weights=total, minlength=len(df))[pidx]
+    return weight[:, None] * voter_matrix(df)[pidx], pidx
+
+
+def turnout_factor(
+    gdf,
+    df,
+    pidx=None,
+    age_turnout=None,
+    votertype_turnout=None,
+    new_voter_bands=default_new_voter_bands,
+):
+    """
+    (seats x races) turnout multipliers of the age-aware turnout model, as
+    `turnout_factor_cols` on `df.index`.
+
+    In every DUN, regular voters turn out at the `age_turnout` rates of their
+    age bands and early and postal voters at their `votertype_turnout` rates,
+    giving a turnout for the `new_voter_bands` and one for older voters; a
+    parlimen's are the voter-weighted means of its DUNs'. A race's growth in
+    voters since GE14 is taken as its new voters, so its turnout in a seat
+    mixes the two in proportion. Each factor is that turnout over its state
+    and race's mean, so the race turnout inputs keep their state-wide
+    meaning. `pidx` is `parlimen_index(gdf, df)`; seats without DUNs keep a
+    factor of 1.
+    """
+    age_turnout = age_turnout or default_age_turnout
+    votertype_turnout = votertype_turnout or default_votertype_turnout
+    if pidx is None:
+        pidx = parlimen_index(gdf, df)
+    dun = pidx >= 0
+    pidx = pidx[dun]
+    gdf = gdf[dun]
+
+    total = gdf["total"].to_numpy(np.float64)
+    special = sum(
+        gdf[f"votertype_{kind}"].to_numpy(np.float64) * rate / 100
+        for kind, rate in votertype_turnout.items()
+    )
+    regular = gdf["votertype_regular"].to_numpy(np.float64) / total
+    turnout = []
+    band_voters = {
+        b: (gdf[f"male_{b}"] + gdf[f"female_{b}"]).to_numpy(np.float64)
+        for b in age_turnout
+    }
+    for bands in [
+        [b for b in age_turnout if b in new_voter_bands],
+        [b for b in age_turnout if b not in new_voter_bands],
+    ]:
+        counts = sum(band_voters[b] for b in bands)
+        voting = sum(band_voters[b] * age_turnout[b] / 100 for b in bands)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            rate = np.nan_to_num(voting / counts) * regular + special / total
+            seat = np.bincount(pidx, rate * counts, len(df)) / np.bincount(
+                pidx, counts, len(df)
+            )
+        turnout.append(seat)
+    new, old = turnout
+
+    voters = df[GE15_race_voter_cols].to_numpy(np.float64)
+    before = df[GE14_race_voter_cols].to_numpy(np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        growth = np.clip(np.nan_to_num((voters - before) / voters), 0, 1)
+    seat = growth * new[:, None] + (1 - growth) * old[:, None]
+
+    known = np.isfinite(seat)
+    seat = np.where(known, seat, 0)
+    weight = voters * known
+    sidx, state_names = pd.factorize(df["state"].astype(str))
+    state = _group_sum(sidx, seat * weight, len(state_names)) / _group_sum(
+        sidx, weight, len(state_names)
+    )
+    with np.errstate(divide="ignore", invalid="ignore"):
+        factor = seat / state[sidx]
+    factor = np.where(known & np.isfinite(factor), factor, 1.0)
+    return pd.DataFrame(factor, index=df.index, columns=turnout_factor_cols)
+
+
+def project_duns(gdf, df, data, states, parties=parties, pidx=None, overrides=None):
+    """
+    Estimated votes and `estimate_party` for every state assembly seat (DUN)
+    of `states`, under the same `data` inputs and seat `overrides` as the
+    parlimen projection; a DUN takes its parlimen's adjustments.
+    `pidx` is `parlimen_index(gdf, df)` when already built.
+
+    Without per-DUN race columns in `gdf`, every DUN takes its parlimen's race
+    mix, so its winner is the parlimen's `estimate_party`; only the vote
+    counts are split. Safe-seat, forced and hard-rule calls are parlimen calls
+    and are not applied to DUNs; the parlimen's final `party`, when `df` has one, is
+    carried as `parlimen_party`. Federal territories, whose voters_ge15 rows
+    are whole parlimen (`dun == parlimen`), have no DUNs and are left out.
+    """
+    rows = (
+        gdf["state"].isin(states)
+        & (gdf["dun"].astype(str) != gdf["parlimen"].astype(str))
+    ).to_numpy()
+    gdf = gdf[rows]
+    voters, pidx = dun_voter_matrix(gdf, df, None if pidx is None else pidx[rows])
+    votes, winner = project(
+        voters, state_index(gdf, states), support_tensor(data, states, parties)
+    )
+    if overrides is not None:
+        # the parlimen's adjusted inputs, gathered onto its DUNs
+        seats, at = np.unique(pidx, return_inverse=True)
+        T, S = seat_inputs(
+            df.index[seats],
+            state_index(df.iloc[seats], states),
+            *_state_means(data, states, parties),
+            overrides,
+        )
+        votes = np.einsum("dr,dpr->dp", voters, T[at][:, None, :] * S[at] / 10000)
+        winner = votes.argmax(axis=1)
+    out = gdf[["state", "parlimen", "dun"]].reset_index(drop=True)
+    out["##"] = df["##"].to_numpy()[pidx]
+    for k, party in enumerate(parties):
+        out[party] = votes[:, k]
+    out["estimate_party"] = np.array(parties, dtype=object)[winner]
+    if "party" in df:
+        out["parlimen_party"] = df["party"].to_numpy()[pidx]
+    return out
+
+
+def _group_sum(codes, values, n):
+    """Column sums of (rows x k) `values` over `n` groups of row `codes`."""
+    return np.stack(
+        [np.bincount(codes, weights=v, minlength=n) for v in values.T], axis=1
+    )
+
+
+def roll_up_duns(duns, parties=parties):
+    """
+    Parlimen and state totals of a `project_duns` frame. Votes are summed, so a
+    parlimen's `estimate_party` is the one its own projection gives; DUN seats
+    won per party are counted as `{party}_dun_seats`, and at state level the
+    parlimen won as `{party}_parlimen_seats`, by `parlimen_party` when the
+    frame has it.
+    """
+    names = np.array(parties, dtype=object)
+    dun_seats = [f"{party}_dun_seats" for party in parties]
+    parlimen_seats = [f"{party}_parlimen_seats" for party in parties]
+    won = duns["estimate_party"].to_numpy()[:, None] == names[None, :]
+
+    pcodes, _ = pd.factorize(duns["##"])
+    first = np.unique(pcodes, return_index=True)[1]
+    votes = _group_sum(pcodes, duns[parties].to_numpy(), len(first))
+    seats = _group_sum(pcodes, won, len(first)).astype(np.int64)
+    winner = votes.argmax(axis=1)
+    parlimen = pd.concat(
+        [
+            duns[["state", "##", "parlimen"]].iloc[first].reset_index(drop=True),
+            pd.DataFrame(np.hstack([votes, seats]), columns=parties + dun_seats),
+        ],
+        axis=1,
+    ).astype({c: np.int64 for c in dun_seats})
+    parlimen["estimate_party"] = names[winner]
+
+    scodes, state_names = pd.factorize(parlimen["state"].astype(str))
+    n = len(state_names)
+    state = pd.DataFrame(
+        _group_sum(scodes, votes, n),
+        index=pd.Index(state_names, name="state"),
+        columns=parties,
+    )
+    state[dun_seats] = _group_sum(scodes, seats, n).astype(np.int64)
+    if "parlimen_party" in duns:
+        called = duns["parlimen_party"].to_numpy()[first][:, None] == names[None, :]
+    else:
+        called = winner[:, None] == np.arange(len(parties))
+    state[parlimen_seats] = _group_sum(scodes, called, n).astype(np.int64)
+    return {"parlimen": parlimen, "state": state}
+
+
+def _state_means(data, states, parties=parties):
+    turnout = np.array(
+        [[data[f"{state}_{race}_turnout"] for race in races] for state in states],
+        dtype=np.float64,
+    )
+    support = np.array(
+        [
+            [
+                [data[f"{state}_{party}_{race}_support"] for race in races]
+                for party in parties
+            ]
+            for state in states
+        ],
+        dtype=np.float64,
+    )
+    return turnout, support
+
+
+def standing_pairs(support):
+    """(state, party) codes of the pairs with any support in `support`."""
+    return np.nonzero(support.sum(axis=2) > 0)
+
+
+def sample_inputs(
+    data, states, n, turnout_sd=3.0, support_sd=3.0, rng=None, parties=parties
+):
+    """
+    `n` draws of the turnout (states x races x n) and of the support (pairs x
+    races x n) of each `standing_pairs` (state, party) pair, both normal
+    around the `data` inputs with the given spread in percentage points and
+    clipped to 0-100. Parties not standing in a state are not drawn; draws
+    run along the last axis so each pair's are one contiguous block.
+    """
+    rng = np.random.default_rng(rng)
+    turnout, support = _state_means(data, states, parties)
+    support = support[standing_pairs(support)]
+    t = rng.standard_normal(turnout.shape + (n,), dtype=np.float32)
+    t *= turnout_sd
+    t += turnout.astype(np.float32)[..., None]
+    s = rng.standard_normal(support.shape + (n,), dtype=np.float32)
+    s *= support_sd
+    s += support.astype(np.float32)[..., None]
+    np.clip(t, 0, 100, out=t)
+    np.clip(s, 0, 100, out=s)
+    return t, s
+
+
+def state_blocks(voters, sidx, n_states):
+    """
+    A seat order that groups seats by state, the (start, stop) bounds of each
+    state's run in it and each state's (seats x races) voter block, so that a
+    state's votes are its block @ its (races x draws) inputs.
+    """
+    order = np.argsort(sidx, kind="stable")
+    bounds = np.searchsorted(sidx[order], np.arange(n_states + 1))
+    blocks = [
+        voters[order[start:stop]].astype(np.float32)
+        for start, stop in zip(bounds[:-1], bounds[1:])
+    ]
+    return order, bounds, blocks
+
+
+def leading_party(votes):
+    """Index of the leading party along the last axis, first party on ties."""
+    best = votes[..., 0].copy()
+    winner = np.zeros(best.shape, dtype=np.int8)
+    for k in range(1, votes.shape[-1]):
+        np.copyto(winner, k, where=votes[..., k] > best)
+        np.maximum(best, votes[..., k], out=best)
+    return winner
+
+
+def simulate(
+    df,
+    data,
+    states,
+    n=100000,
+    turnout_sd=3.0,
+    support_sd=3.0,
+    majority=112,
+    base_party=None,
+    seed=None,
+    chunk=1000,
+    parties=parties,
+    overrides=None,
+):
+    """
+    Monte Carlo seat distribution around the `data` inputs, with the support
+    and turnout deltas of `overrides` added to every draw.
+
+    Seats with a `base_party` (safe, forced or hard-rule seats) keep that
+    party in every draw. Each chunk of draws is sampled in one block over
+    the standing (state, party) pairs, and a party never wins a seat in a
+    state where it does not stand; chunks are small enough for their votes
+    to stay in cache. Returns a dict with the per-draw seat counts, a
+    seat-count histogram per party, P(seats >= majority) per party and
+    per-seat win probabilities.
+    """
+    rng = np.random.default_rng(seed)
+    voters = voter_matrix(df)
+    sidx = state_index(df, states)
+    # seats in state order from here on; `wins` goes back to df order
+    order, bounds, blocks = state_blocks(voters, sidx, len(states))
+    voters, sidx = voters[order], sidx[order]
+    _, support = _state_means(data, states, parties)
+    pair_states, pair_parties = standing_pairs(support)
+    deltas = None
+    if overrides is not None:
+        deltas = _override_deltas(df.index[order], overrides, len(parties), len(races))
+        if not len(deltas[0]):
+            deltas = None
+    fixed = (
+        pd.Index(parties).get_indexer(pd.Series(base_party, dtype=object))
+        if base_party is not None
+        else np.full(len(df), -1)
+    )[order]
+    fixed_mask = fixed >= 0
+
+    n_seats, n_parties = len(df), len(parties)
+    codes = np.arange(n_parties, dtype=np.int8)[:, None, None]
+    seats = np.empty((n, n_parties), dtype=np.int16)
+    wins = np.zeros((n_parties, n_seats), dtype=np.int64)
+    # (parties x seats x draws); only standing pairs are ever written, so
+    # parties not standing in a seat's state stay at -inf and never lead
+    votes = np.full((n_parties, n_seats, min(chunk, n)), -np.inf, dtype=np.float32)
+    for start in range(0, n, chunk):
+        m = min(chunk, n - start)
+        t, s = sample_inputs(
+            data, states, m, turnout_sd, support_sd, rng=rng, parties=parties
+        )
+        if deltas is not None:
+            full = np.zeros((m, len(states), n_parties, len(races)), np.float32)
+            full[:, pair_states, pair_parties] = s.transpose(2, 0, 1)
+        s *= (t / 10000)[pair_states]
+        for k, (state, party) in enumerate(zip(pair_states, pair_parties)):
+            rows = slice(bounds[state], bounds[state + 1])
+            np.matmul(blocks[state], s[k], out=votes[party, rows, :m])
+        # (seats x draws x parties)
+        draws = votes[:, :, :m].transpose(1, 2, 0)
+        if deltas is not None:
+            draws = _add_deltas(
+                draws.transpose(1, 0, 2),
+                voters,
+                sidx,
+                t.transpose(2, 0, 1),
+                full,
+                *deltas,
+            ).transpose(1, 0, 2)
+        winner = leading_party(draws)
+        winner[fixed_mask] = fixed[fixed_mask, None]
+        won = winner == codes
+        seats[start : start + m] = won.sum(axis=1, dtype=np.int16).T
+        wins += won.sum(axis=2, dtype=np.int32)
+    wins = wins.T[np.argsort(order)]
+
+    histogram = pd.DataFrame(
+        {
+            party: np.bincount(seats[:, k], minlength=n_seats + 1)
+            for k, party in enumerate(parties)
+        }
+    )
+    histogram.index.name = "seats"
+    return {
+        "seats": pd.DataFrame(seats, columns=parties),
+        "histogram": histogram,
+        "majority_prob": pd.Series((seats >= majority).mean(axis=0), index=parties),
+        "win_prob": pd.DataFrame(
+            wins / n,
+            index=df["constituency"].to_numpy() if "constituency" in df else None,
+            columns=parties,
+        ),
+    }
@@ -0,0 +1,147 @@
+"""
+Flip thresholds: for every seat and party, the shift in that party's support
+(percentage points, in one race or uniformly across races) at which the seat
+changes hands from its `estimate_party`. Thresholds are kept sorted so "what
+flips" questions are binary searches rather than reprojections. Each threshold
+assumes that party's shift is the only change.
+"""
+import numpy as np
+import pandas as pd
+
+from engine import (
+    _state_means,
+    override_votes,
+    parties,
+    project,
+    races,
+    seat_inputs,
+    state_index,
+    support_tensor,
+    voter_matrix,
+)
+
+UNIFORM = "All"
+
+
+def flip_index(df, data, states, base_party=None, parties=parties, overrides=None):
+    """
+    Build the flip index for `df` under the `data` inputs and the seat
+    `overrides`. Seats with a `base_party` (safe, forced or hard-rule seats)
+    never flip and are left out.
+    """
+    voters = voter_matrix(df)
+    sidx = state_index(df, states)
+    votes, winner = project(voters, sidx, support_tensor(data, states, parties))
+    turnout, support = _state_means(data, states, parties)
+    if overrides is not None:
+        votes = override_votes(
+            votes, df.index, voters, sidx, turnout, support, overrides
+        )
+        winner = votes.argmax(axis=1)
+    seat_turnout, _ = seat_inputs(df.index, sidx, turnout, support, overrides)
+
+    # votes gained per point of support, per race and across all races
+    per_point = voters * seat_turnout / 10000
+    per_point = np.concatenate([per_point, per_point.sum(axis=1, keepdims=True)], 1)
+
+    rows = np.arange(len(df))
+    ranked = np.argsort(-votes, axis=1, kind="stable")
+    runner_up = ranked[:, 1]
+    lead = votes[rows, winner] - votes[rows, runner_up]
+
+    # challengers need to close the gap to the winner, the winner needs to
+    # lose its lead over the runner-up
+    gap = votes[rows, winner][:, None] - votes
+    gap[rows, winner] = -lead
+    with np.errstate(divide="ignore", invalid="ignore"):
+        thresholds = gap[:, :, None] / per_point[:, None, :]
+    thresholds[~np.isfinite(thresholds)] = np.nan
+    # parties not standing in a seat's state cannot take it
+    thresholds[~(support.sum(axis=2) > 0)[sidx]] = np.nan
+    if base_party is not None:
+        fixed = pd.Series(base_party, dtype=object).notna().to_numpy()
+        thresholds[fixed] = np.nan
+
+    keys = races + [UNIFORM]
+    index = {}
+    for p, party in enumerate(parties):
+        for r, race in enumerate(keys):
+            t = thresholds[:, p, r]
+            valid = np.flatnonzero(~np.isnan(t))
+            national = valid[np.argsort(t[valid], kind="stable")]
+            by_state = valid[np.lexsort((t[valid], sidx[valid]))]
+            index[(party, race)] = {
+                "national": (t[national], national),
+                "state": (
+                    t[by_state],
+                    by_state,
+                    np.searchsorted(sidx[by_state], np.arange(len(states) + 1)),
+                ),
+            }
+
+    margin = thresholds[rows, runner_up, len(races)]
+    margin_order = np.flatnonzero(~np.isnan(margin))
+    margin_order = margin_order[np.argsort(margin[margin_order], kind="stable")]
+    return {
+        "df": df[["state", "constituency"]].reset_index(drop=True),
+        "states": list(states),
+        "parties": list(parties),
+        "winner": winner,
+        "runner_up": runner_up,
+        "lead": lead,
+        "margin": margin,
+        "margin_order": margin_order,
+        "thresholds": index,
+    }
+
+
+def _seat_frame(index, seats, threshold, to):
+    out = index["df"].iloc[seats].copy()
+    names = np.array(index["parties"], dtype=object)
+    out["from"] = names[index["winner"][seats]]
+    out["to"] = to
+    out["threshold"] = threshold
+    out["lead"] = index["lead"][seats]
+    return out
+
+
+def flips(index, party, shift, race=None, state=None):
+    """
+    Seats that change hands if `party`'s support moves by `shift` points in
+    `race` (every race when None), nationally or in one `state`.
+    """
+    entry = index["thresholds"][(party, race or UNIFORM)]
+    if state is None:
+        values, seats = entry["national"]
+    else:
+        values, seats, offsets = entry["state"]
+        k = index["states"].index(state)
+        values = values[offsets[k] : offsets[k + 1]]
+        seats = seats[offsets[k] : offsets[k + 1]]
+
+    if shift >= 0:
+        lo = np.searchsorted(values, 0, side="right")
+        hi = np.searchsorted(values, shift, side="right")
+        seats = seats[lo:hi]
+        to = party
+    else:
+        lo = np.searchsorted(values, shift, side="left")
+        hi = np.searchsorted(values, 0, side="left")
+        seats = seats[lo:hi]
+        to = np.array(index["parties"], dtype=object)[index["runner_up"][seats]]
+    return _seat_frame(index, seats, values[lo:hi], to)
+
+
+def marginal_seats(index, n=20, state=None):
+    """
+    The `n` seats with the smallest uniform support shift that hands them to
+    their runner-up.
+    """
+    seats = index["margin_order"]
+    if state is not None:
+        seats = seats[index["df"]["state"].to_numpy()[seats] == state]
+    seats = seats[:n]
+    names = np.array(index["parties"], dtype=object)
+    return _seat_frame(
+        index, seats, index["margin"][seats], names[index["runner_up"][seats]]
+    )
@@ -0,0 +1,162 @@
+"""
+Typed dataset loading. Each source CSV is parsed once into a compact frame
+(categorical labels, int32/float32 numbers) and cached as Parquet next to the
+data; the cache is rebuilt only when the CSV's content changes.
+"""
+import hashlib
+import json
+import os
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+DATA_PATH = "data/new_voters.csv"
+DATA_PATH_GE15 = "data/voters_ge15.csv"
+PARAMETERS_PATH = "data/malay_parameters.csv"
+SABAH_PARAMETERS_PATH = "data/sabah_parameters.csv"
+SARAWAK_PARAMETERS_PATH = "data/sarawak_parameters.csv"
+# one parameters file per region, each with its own party columns
+REGION_PARAMETERS_PATHS = [
+    PARAMETERS_PATH,
+    SABAH_PARAMETERS_PATH,
+    SARAWAK_PARAMETERS_PATH,
+]
+# optional per-seat overrides, see engine.compile_overrides
+OVERRIDES_PATH = "data/seat_overrides.csv"
+CACHE_DIR = "data/.cache"
+
+# bump when the compaction rules change so old caches are rebuilt
+CACHE_VERSION = 2
+
+NEW_VOTERS_CATEGORIES = ["state", "constituency", "2004", "2008", "2013", "2018"]
+GE15_CATEGORIES = ["state", "parlimen", "dun"]
+PARAMETERS_CATEGORIES = ["state"]
+
+
+def source_signature(path):
+    """(mtime_ns, size) of a source file, cheap enough to check every rerun."""
+    stat = os.stat(path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def file_hash(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def compact(df, categories=(), float_dtype="float32"):
+    """
+    `df` with `categories` as categoricals and numbers downcast. Voter counts
+    (columns named `*_voters*`) stay float64: the GE14 counts are fractional
+    estimates, and float32 moves their totals.
+    """
+    df = df.copy()
+    for col in categories:
+        df[col] = df[col].astype("category")
+    for col in df.select_dtypes(include=["int64"]).columns:
+        if df[col].abs().max() < np.iinfo(np.int32).max:
+            df[col] = df[col].astype(np.int32)
+    if float_dtype is not None:
+        for col in df.select_dtypes(include=["float64"]).columns:
+            if "_voters" not in col:
+                df[col] = df[col].astype(float_dtype)
+    return df
+
+
+def _read_cache(path):
+    df = pd.read_parquet(path)
+    # Parquet gives categories back in order of appearance; keep them sorted
+    # so groupby output is ordered as it is for plain strings
+    for col in df.select_dtypes(include=["category"]).columns:
+        df[col] = df[col].cat.reorder_categories(sorted(df[col].cat.categories))
+    return df
+
+
+def _write_atomic(path, write):
+    """
+    Write `path` with `write(tmp_path)` through a temp file in the same
+    directory, so concurrent readers see the old file or the new one, never
+    a partial one.
+    """
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    os.close(fd)
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def load_csv(path, categories=(), float_dtype="float32", cache_dir=CACHE_DIR):
+    """
+    Compact frame for the CSV at `path`, read from the Parquet cache when the
+    CSV is unchanged since it was written. A touched but identical CSV (new
+    mtime, same hash) keeps its cache.
+    """
+    # the same file name in two directories gets two caches
+    name = "{}-{}".format(
+        os.path.splitext(os.path.basename(path))[0],
+        hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:8],
+    )
+    cache_path = os.path.join(cache_dir, f"{name}.parquet")
+    meta_path = os.path.join(cache_dir, f"{name}.json")
+    mtime_ns, size = source_signature(path)
+    options = {
+        "version": CACHE_VERSION,
+        "categories": list(categories),
+        "float_dtype": float_dtype,
+    }
+
+    meta = None
+    if os.path.exists(meta_path) and os.path.exists(cache_path):
+        with open(meta_path) as f:
+            meta = json.load(f)
+        if meta.get("options") != options or meta.get("size") != size:
+            meta = None
+
+    if meta is not None and meta.get("mtime_ns") == mtime_ns:
+        return _read_cache(cache_path)
+
+    sha1 = file_hash(path)
+    if meta is None or meta.get("sha1") != sha1:
+        df = compact(pd.read_csv(path), categories, float_dtype)
+        os.makedirs(cache_dir, exist_ok=True)
+        _write_atomic(cache_path, lambda p: df.to_parquet(p, index=False))
+    else:
+        df = _read_cache(cache_path)
+
+    # the Parquet file is in place before the meta that vouches for it
+    meta = {"mtime_ns": mtime_ns, "size": size, "sha1": sha1, "options": options}
+
+    def write_meta(p):
+        with open(p, "w") as f:
+            json.dump(meta, f)
+
+    _write_atomic(meta_path, write_meta)
+    return df
+
+
+def load_new_voters(path=DATA_PATH, cache_dir=CACHE_DIR):
+    return load_csv(path, NEW_VOTERS_CATEGORIES, cache_dir=cache_dir)
+
+
+def load_voters_ge15(path=DATA_PATH_GE15, cache_dir=CACHE_DIR):
+    return load_csv(path, GE15_CATEGORIES, cache_dir=cache_dir)
+
+
+def load_parameters_frame(path=PARAMETERS_PATH, cache_dir=CACHE_DIR):
+    # support baselines stay float64: scenario_data truncates them with int()
+    return load_csv(path, PARAMETERS_CATEGORIES, float_dtype=None, cache_dir=cache_dir)
+
+
+def load_overrides_frame(path=OVERRIDES_PATH):
+    """The seat overrides file, or None when there is none."""
+    if not os.path.exists(path):
+        return None
+    labels = {col: str for col in ["##", "winner", "party", "race"]}
+    return pd.read_csv(path, dtype=labels)
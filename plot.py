@@ -3,29 +3,90 @@ import numpy as np
 import plotly.graph_objs as go
 
 
-def get_table1(df, gdf):
-    tdf = pd.melt(
-        df[["state", "GE14_registered_voters", "GE15_registered_voters"]].rename(
-            columns={"GE14_registered_voters": "GE14", "GE15_registered_voters": "GE15"}
+voter_races = ["malay", "chinese", "indian", "others"]
+voter_elections = ["GE14", "GE15"]
+
+
+def voter_cube(df, gdf):
+    """
+    Voters summed by state once per dataset, for the descriptive tables.
+
+    index       states (sorted) + "Total"
+    voters      (index x voter_races x voter_elections) race voters
+    registered  (index x voter_elections) registered voters
+    young       (index x [male_18_20, female_18_20]) GE15 voters aged 18-20
+    """
+    race_cols = [
+        f"{ge}_{race}_voters" for race in voter_races for ge in voter_elections
+    ]
+    registered_cols = [f"{ge}_registered_voters" for ge in voter_elections]
+    by_state = df.groupby("state")[race_cols + registered_cols].sum()
+    states = by_state.index.astype(str).tolist()
+
+    voters = by_state[race_cols].to_numpy(np.int64)
+    voters = voters.reshape(len(states), len(voter_races), len(voter_elections))
+    registered = by_state[registered_cols].to_numpy(np.int64)
+
+    young = gdf.groupby("state")[["male_18_20", "female_18_20"]].sum()
+    young.index = young.index.astype(str)
+    young_total = young.sum().to_numpy()
+    young = young.reindex(states).to_numpy()
+    return {
+        "index": states + ["Total"],
+        "voters": np.concatenate([voters, voters.sum(axis=0, keepdims=True)]),
+        "registered": np.concatenate(
+            [registered, registered.sum(axis=0, keepdims=True)]
         ),
-        id_vars=["state"],
-        var_name="GE",
-        value_name="registered_voters",
-    )
-    tdf = tdf.pivot_table(
-        index="state", columns="GE", values="registered_voters", aggfunc="sum"
-    )
-    tdf.columns.name = None
-    tdf.index.name = None
-    tdf.loc["Total"] = tdf.sum()
+        "young": np.concatenate([young, young_total[None]]),
+    }
+
+
+def registered_frame(cube):
+    """Registered and young voters by state, with a Total row."""
+    tdf = pd.DataFrame(cube["registered"], index=cube["index"], columns=voter_elections)
     tdf["registered_voters_increase"] = tdf["GE15"] - tdf["GE14"]
     tdf["registered_voters_increase_pct"] = (tdf["GE15"] / tdf["GE14"] - 1) * 100
-
-    ydf = gdf.groupby(["state"])[["male_18_20", "female_18_20"]].sum()
-    ydf["young_voters"] = ydf.sum(axis=1)
-    ydf.loc["Total"] = ydf.sum()
-    tdf = tdf.merge(ydf, left_index=True, right_index=True, how="left")
+    young = pd.DataFrame(
+        cube["young"], index=cube["index"], columns=["male_18_20", "female_18_20"]
+    )
+    tdf[young.columns] = young
+    tdf["young_voters"] = young.sum(axis=1, min_count=1)
     tdf["young_voters_pct"] = tdf["young_voters"] / tdf["GE15"] * 100
+    return tdf
+
+
+def race_frame(cube):
+    """Race voters by state with their increases and ratios, no Total row."""
+    voters = cube["voters"][:-1]
+    tdf = pd.DataFrame(index=cube["index"][:-1])
+    for g, ge in enumerate(voter_elections):
+        for r, race in enumerate(voter_races):
+            tdf[f"{ge}_{race}_voters"] = voters[:, r, g]
+
+    for i in voter_races:
+        tdf[f"{i}_voters_increase"] = tdf[f"GE15_{i}_voters"] - tdf[f"GE14_{i}_voters"]
+    for i in voter_races:
+        tdf[f"{i}_voters_increase_pct"] = (
+            tdf[f"GE15_{i}_voters"] / tdf[f"GE14_{i}_voters"] - 1
+        ) * 100
+
+    for g, ge in enumerate(voter_elections):
+        tdf[f"{ge}_voters"] = voters[:, :, g].sum(axis=1)
+
+    for ge in voter_elections:
+        for i in voter_races:
+            tdf[f"{ge}_{i}_ratio"] = tdf[f"{ge}_{i}_voters"] / tdf[f"{ge}_voters"] * 100
+
+    tdf = tdf.replace(np.inf, np.nan)
+    return tdf[
+        [i for i in tdf.columns if i.endswith("increase")]
+        + [i for i in tdf.columns if i.endswith("increase_pct")]
+        + [i for i in tdf.columns if "increase" not in i]
+    ]
+
+
+def get_table1(cube):
+    tdf = registered_frame(cube)
 
     u = tdf.index.get_level_values(0)
 
@@ -61,8 +122,62 @@ def get_table1(df, gdf):
     return tdf
 
 
-def plot_age_group(tdf, state):
+age_genders = ["female", "male"]
+
+
+def age_cube(gdf):
+    """
+    GE15 voters as a dense int32 (DUN x gender x age band) cube. DUNs are
+    ordered by state then parlimen, so each state and parlimen is a row range
+    and its pyramid is a difference of two prefix sums.
+
+    counts    (DUN x age_genders x bands) voters
+    prefix    cumulative sum of counts over DUNs, with a leading zero row
+    states    {state: (start, stop)} in order of appearance
+    parlimen  {parlimen: (start, stop)} by state, then in order of appearance
+    """
+    cols = [c for c in gdf.columns if c.split("_", 1)[0] in age_genders]
+    bands = sorted({c.split("_", 1)[1] for c in cols})
+    state_codes, states = pd.factorize(gdf["state"].astype(str))
+    parlimen_codes, parlimen = pd.factorize(gdf["parlimen"].astype(str))
+    order = np.lexsort((parlimen_codes, state_codes))
+
+    counts = gdf[[f"{g}_{b}" for g in age_genders for b in bands]].to_numpy(np.int32)
+    counts = counts[order].reshape(len(gdf), len(age_genders), len(bands))
+    prefix = np.zeros((len(gdf) + 1,) + counts.shape[1:], dtype=np.int64)
+    np.cumsum(counts, axis=0, out=prefix[1:])
+
+    def ranges(labels):
+        # each name is one run of `labels`; factorizing them in cube order
+        # numbers the runs in sequence, so the codes are sorted
+        codes, names = pd.factorize(labels)
+        bounds = np.searchsorted(codes, np.arange(len(names) + 1))
+        return {n: (bounds[k], bounds[k + 1]) for k, n in enumerate(names)}
+
+    return {
+        "bands": bands,
+        "counts": counts,
+        "prefix": prefix,
+        "states": ranges(states[state_codes[order]]),
+        "parlimen": ranges(parlimen[parlimen_codes[order]]),
+    }
+
+
+def age_pyramid(cube, name="Malaysia"):
+    """(age_genders x bands) voters of a state, a parlimen or "Malaysia"."""
+    if name == "Malaysia":
+        start, stop = 0, len(cube["counts"])
+    elif name in cube["states"]:
+        start, stop = cube["states"][name]
+    else:
+        start, stop = cube["parlimen"][name]
+    return cube["prefix"][stop] - cube["prefix"][start]
+
+
+def plot_age_group(cube, name):
     """
+    Age pyramid of `name`, a state, a parlimen or "Malaysia".
+
     		female	male
     18_20	5908	5980
     21_29	20104	21211
@@ -74,12 +189,11 @@ def plot_age_group(tdf, state):
     80_89	2321	1496
     90+		390		284
     """
-    tdf = tdf.groupby(["gender", "age_group"])["value"].sum().reset_index()
-    tdf = tdf.pivot(index="age_group", columns=["gender"], values="value").reset_index()
-    total_voters = tdf["male"].sum() + tdf["female"].sum()
-    y_age = tdf["age_group"]  # tdf.index
-    x_M = tdf["male"] * -1
-    x_F = tdf["female"]
+    female, male = age_pyramid(cube, name)
+    total_voters = male.sum() + female.sum()
+    y_age = cube["bands"]
+    x_M = male * -1
+    x_F = female
 
     fig = go.Figure()
 
@@ -115,60 +229,33 @@ def plot_age_group(tdf, state):
         barmode="overlay",
         bargap=0.1,
         plot_bgcolor="white",
-        title=f"{state}: {total_voters:,} voters",
+        title=f"{name}: {total_voters:,} voters",
     )
 
     fig.update_layout(layout)
     return fig
 
 
-def get_race_table(df):
-    cols = [
-        f"{i}_{j}_voters"
-        for i in ["GE14", "GE15"]
-        for j in ["malay", "chinese", "indian", "others"]
-    ]
-    tdf = df.groupby(["state"])[cols].sum()
-    for i in tdf.columns:
-        tdf[i] = tdf[i].astype(int)
+def age_group_figure(cube, name, cache=None):
+    """
+    `plot_age_group` memoized by region name in `cache`. Cached figures are
+    shared, so callers must not modify them.
+    """
+    if cache is None:
+        return plot_age_group(cube, name)
+    fig = cache.get(name)
+    if fig is None:
+        fig = cache[name] = plot_age_group(cube, name)
+    return fig
 
-    for i in ["malay", "chinese", "indian", "others"]:
-        tdf[f"{i}_voters_increase"] = tdf[f"GE15_{i}_voters"] - tdf[f"GE14_{i}_voters"]
-    for i in ["malay", "chinese", "indian", "others"]:
-        tdf[f"{i}_voters_increase_pct"] = (
-            tdf[f"GE15_{i}_voters"] / tdf[f"GE14_{i}_voters"] - 1
-        ) * 100
 
-    tdf["GE14_voters"] = tdf[
-        [
-            "GE14_malay_voters",
-            "GE14_chinese_voters",
-            "GE14_indian_voters",
-            "GE14_others_voters",
-        ]
-    ].sum(axis=1)
-    tdf["GE15_voters"] = tdf[
-        [
-            "GE15_malay_voters",
-            "GE15_chinese_voters",
-            "GE15_indian_voters",
-            "GE15_others_voters",
-        ]
-    ].sum(axis=1)
-
-    for i in ["malay", "chinese", "indian", "others"]:
-        tdf[f"GE14_{i}_ratio"] = tdf[f"GE14_{i}_voters"] / tdf["GE14_voters"] * 100
-    for i in ["malay", "chinese", "indian", "others"]:
-        tdf[f"GE15_{i}_ratio"] = tdf[f"GE15_{i}_voters"] / tdf["GE15_voters"] * 100
+def age_group_regions(cube):
+    """Every region with a pyramid: Malaysia, the states, then the parlimen."""
+    return ["Malaysia"] + list(cube["states"]) + list(cube["parlimen"])
 
-    tdf = tdf.replace(np.inf, np.nan)
-    tdf = tdf[
-        [i for i in tdf.columns if i.endswith("increase")]
-        + [i for i in tdf.columns if i.endswith("increase_pct")]
-        + [i for i in tdf.columns if "increase" not in i]
-    ]
 
-    tdf.index.name = None
+def get_race_table(cube):
+    tdf = race_frame(cube)
 
     green_bar_color = "#54C571"
     red_bar_color = "#FF6347"
@@ -286,53 +373,8 @@ def get_race_table(df):
     return tdf
 
 
-def get_race_table2(df):
-    cols = [
-        f"{i}_{j}_voters"
-        for i in ["GE14", "GE15"]
-        for j in ["malay", "chinese", "indian", "others"]
-    ]
-    tdf = df.groupby(["state"])[cols].sum()
-    for i in tdf.columns:
-        tdf[i] = tdf[i].astype(int)
-
-    for i in ["malay", "chinese", "indian", "others"]:
-        tdf[f"{i}_voters_increase"] = tdf[f"GE15_{i}_voters"] - tdf[f"GE14_{i}_voters"]
-    for i in ["malay", "chinese", "indian", "others"]:
-        tdf[f"{i}_voters_increase_pct"] = (
-            tdf[f"GE15_{i}_voters"] / tdf[f"GE14_{i}_voters"] - 1
-        ) * 100
-
-    tdf["GE14_voters"] = tdf[
-        [
-            "GE14_malay_voters",
-            "GE14_chinese_voters",
-            "GE14_indian_voters",
-            "GE14_others_voters",
-        ]
-    ].sum(axis=1)
-    tdf["GE15_voters"] = tdf[
-        [
-            "GE15_malay_voters",
-            "GE15_chinese_voters",
-            "GE15_indian_voters",
-            "GE15_others_voters",
-        ]
-    ].sum(axis=1)
-
-    for i in ["malay", "chinese", "indian", "others"]:
-        tdf[f"GE14_{i}_ratio"] = tdf[f"GE14_{i}_voters"] / tdf["GE14_voters"] * 100
-    for i in ["malay", "chinese", "indian", "others"]:
-        tdf[f"GE15_{i}_ratio"] = tdf[f"GE15_{i}_voters"] / tdf["GE15_voters"] * 100
-
-    tdf = tdf.replace(np.inf, np.nan)
-    tdf = tdf[
-        [i for i in tdf.columns if i.endswith("increase")]
-        + [i for i in tdf.columns if i.endswith("increase_pct")]
-        + [i for i in tdf.columns if "increase" not in i]
-    ]
-
-    tdf.index.name = None
+def get_race_table2(cube):
+    tdf = race_frame(cube)
 
     green_bar_color = "#54C571"
     red_bar_color = "#FF6347"
@@ -0,0 +1,115 @@
+"""
+Batch export of the GE15 age pyramids for Malaysia, every state and every
+parlimen, as standalone HTML pages or plotly JSON specs.
+
+    python pyramids.py out/ --format html --processes 4
+
+writes one file per region plus an index.json mapping region names to file
+names.
+"""
+import argparse
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import plotly.io as pio
+
+from loader import DATA_PATH_GE15, load_voters_ge15
+from plot import age_cube, age_group_regions, plot_age_group
+
+_cube = None
+
+
+def _init_worker(data_path=DATA_PATH_GE15):
+    global _cube
+    _cube = age_cube(load_voters_ge15(data_path))
+
+
+def region_filename(name, fmt):
+    """File name for `name`, e.g. P.001_Padang_Besar.html for P.001 Padang Besar."""
+    return "{}.{}".format(re.sub(r"[^\w.+-]+", "_", name), fmt)
+
+
+def export_region(name, out_dir, fmt="html", include_plotlyjs="cdn"):
+    """Write the pyramid of one region, returning its file name."""
+    if _cube is None:
+        _init_worker()
+    fig = plot_age_group(_cube, name)
+    filename = region_filename(name, fmt)
+    path = os.path.join(out_dir, filename)
+    if fmt == "html":
+        fig.write_html(path, include_plotlyjs=include_plotlyjs)
+    else:
+        pio.write_json(fig, path)
+    return filename
+
+
+def _export(args):
+    return export_region(*args)
+
+
+def export_pyramids(
+    out_dir,
+    regions=None,
+    fmt="html",
+    include_plotlyjs="cdn",
+    processes=None,
+    chunksize=8,
+    data_path=DATA_PATH_GE15,
+):
+    """
+    Export `regions` (all of them when None) to `out_dir` and write its
+    index.json. `processes=1` runs in this process; otherwise regions are
+    spread over a process pool.
+    """
+    if fmt not in ("html", "json"):
+        raise ValueError(f"unknown format {fmt!r}, expected 'html' or 'json'")
+    os.makedirs(out_dir, exist_ok=True)
+    if regions is None:
+        regions = age_group_regions(age_cube(load_voters_ge15(data_path)))
+    tasks = [(name, out_dir, fmt, include_plotlyjs) for name in regions]
+
+    if processes == 1:
+        _init_worker(data_path)
+        filenames = [_export(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=processes, initializer=_init_worker, initargs=(data_path,)
+        ) as pool:
+            filenames = list(pool.map(_export, tasks, chunksize=chunksize))
+
+    index = dict(zip(regions, filenames))
+    with open(os.path.join(out_dir, "index.json"), "w") as f:
+        json.dump(index, f, indent=1)
+    return index
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("out_dir")
+    parser.add_argument("--format", choices=["html", "json"], default="html")
+    parser.add_argument(
+        "--plotlyjs",
+        default="cdn",
+        help="how HTML pages load plotly.js: cdn, directory or inline",
+    )
+    parser.add_argument("--region", action="append", help="export only these")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--data", default=DATA_PATH_GE15)
+    args = parser.parse_args()
+
+    include_plotlyjs = True if args.plotlyjs == "inline" else args.plotlyjs
+    index = export_pyramids(
+        args.out_dir,
+        regions=args.region,
+        fmt=args.format,
+        include_plotlyjs=include_plotlyjs,
+        processes=args.processes,
+        data_path=args.data,
+    )
+    print(f"wrote {len(index)} pyramids to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,299 @@
+"""
+Standalone HTTP/JSON projection service.
+
+    python service.py --port 8502
+
+    POST /project        one scenario  -> {"seats": {...}, "results": [...]}
+    POST /project/batch  [scenario...] -> [{"seats": ...}, ...]
+    GET  /health
+
+A scenario is the dict `engine.scenario_inputs` takes (undecided_malay,
+hard_base_party, turnout, support, safe_threshold, safe_combo), plus
+"detail": false to leave out the per-seat results. Concurrent requests are
+coalesced into one `project_batch` call, and results are cached by
+scenario content.
+"""
+import argparse
+import hashlib
+import json
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from engine import (
+    compile_overrides,
+    excluded_states,
+    load_parameters,
+    parties,
+    project_batch,
+    scenario_inputs,
+    winner_codes,
+)
+from loader import (
+    DATA_PATH,
+    OVERRIDES_PATH,
+    REGION_PARAMETERS_PATHS,
+    load_new_voters,
+    load_overrides_frame,
+)
+
+SCENARIO_KEYS = {
+    "undecided_malay",
+    "hard_base_party",
+    "turnout",
+    "support",
+    "safe_threshold",
+    "safe_combo",
+}
+
+
+def load_model(
+    data_path=DATA_PATH,
+    parameters_path=REGION_PARAMETERS_PATHS,
+    overrides_path=OVERRIDES_PATH,
+):
+    """The seats, parameters and seat overrides every request is projected against."""
+    df = load_new_voters(data_path)
+    df = df[~df["state"].isin(excluded_states)].copy()
+    overrides = load_overrides_frame(overrides_path)
+    return {
+        "df": df,
+        "states": df["state"].unique().tolist(),
+        "para_data": load_parameters(parameters_path),
+        "history": winner_codes(df),
+        "overrides": None if overrides is None else compile_overrides(overrides, df),
+        "seats": df[["##", "state", "constituency"]].astype(str),
+    }
+
+
+def scenario_key(scenario):
+    return hashlib.sha1(
+        json.dumps(scenario, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+def project_scenarios(model, scenarios):
+    """Full results for `scenarios`, projected as one batch."""
+    inputs = [
+        scenario_inputs(s, model["para_data"], model["states"]) for s in scenarios
+    ]
+    votes, estimate, base, party = project_batch(
+        model["df"],
+        [data for data, _ in inputs],
+        model["states"],
+        [hard_base_party for _, hard_base_party in inputs],
+        history=model["history"],
+        overrides=model["overrides"],
+    )
+    names = np.array(list(parties) + [None], dtype=object)
+    seats = model["seats"]
+    results = []
+    for b in range(len(scenarios)):
+        counts = np.bincount(party[b], minlength=len(parties))
+        frame = seats.copy()
+        for k, name in enumerate(parties):
+            frame[name] = votes[b, :, k].round(1)
+        frame["estimate_party"] = names[estimate[b]]
+        frame["base_party"] = names[base[b]]
+        frame["party"] = names[party[b]]
+        results.append(
+            {
+                "seats": dict(zip(parties, counts.tolist())),
+                "results": frame.to_dict(orient="records"),
+            }
+        )
+    return results
+
+
+class Batcher:
+    """
+    Coalesces scenarios submitted from many threads into batches of at most
+    `max_batch`, waiting up to `max_wait` seconds for a batch to fill, and
+    caches up to `max_entries` results by scenario content. `submit` gives up
+    after `timeout` seconds.
+    """
+
+    def __init__(
+        self, model, max_batch=64, max_wait=0.005, max_entries=4096, timeout=60.0
+    ):
+        self.model = model
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.cache = {}
+        # the cache is shared by the handler threads and the batch thread
+        self.lock = threading.Lock()
+        self.queue = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def submit(self, scenarios):
+        """
+        Results for `scenarios`, in order. Raises
+        `concurrent.futures.TimeoutError` when they take longer than
+        `timeout` seconds.
+        """
+        keys = [scenario_key(s) for s in scenarios]
+        futures = {}
+        for key, scenario in zip(keys, scenarios):
+            if key in futures:
+                continue
+            futures[key] = Future()
+            # pop-and-reinsert keeps the cache in LRU order
+            with self.lock:
+                result = self.cache.pop(key, None)
+                if result is not None:
+                    self.cache[key] = result
+            if result is not None:
+                futures[key].set_result(result)
+            else:
+                self.queue.put((key, scenario, futures[key]))
+        deadline = time.monotonic() + self.timeout
+        return [
+            futures[key].result(timeout=max(0, deadline - time.monotonic()))
+            for key in keys
+        ]
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            # the same scenario from concurrent requests is projected once
+            scenarios = {key: scenario for key, scenario, _ in batch}
+            try:
+                results = project_scenarios(self.model, list(scenarios.values()))
+            except Exception:
+                # project one by one so a bad scenario only fails its request
+                results = []
+                for scenario in scenarios.values():
+                    try:
+                        results.append(project_scenarios(self.model, [scenario])[0])
+                    except Exception as e:
+                        results.append(e)
+            results = dict(zip(scenarios, results))
+            with self.lock:
+                for key, result in results.items():
+                    if not isinstance(result, Exception):
+                        self.cache[key] = result
+                while len(self.cache) > self.max_entries:
+                    self.cache.pop(next(iter(self.cache)))
+            for key, _, future in batch:
+                if isinstance(results[key], Exception):
+                    future.set_exception(results[key])
+                else:
+                    future.set_result(results[key])
+
+
+class Server(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 resets connections under bursts of requests
+    request_queue_size = 256
+
+
+def validate(scenario):
+    """`scenario` split into the projection inputs and the detail flag."""
+    if not isinstance(scenario, dict):
+        raise ValueError("a scenario must be a JSON object")
+    unknown = set(scenario) - SCENARIO_KEYS - {"detail"}
+    if unknown:
+        raise ValueError(f"unknown scenario keys: {sorted(unknown)}")
+    detail = scenario.get("detail", True)
+    return {k: v for k, v in scenario.items() if k != "detail"}, detail
+
+
+def respond(result, detail):
+    return result if detail else {"seats": result["seats"]}
+
+
+def make_handler(batcher):
+    class Handler(BaseHTTPRequestHandler):
+        def _send(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            if self.path == "/health":
+                self._send(200, {"status": "ok", "seats": len(batcher.model["df"])})
+            else:
+                self._send(404, {"error": f"no route {self.path}"})
+
+        def do_POST(self):
+            if self.path not in ("/project", "/project/batch"):
+                self._send(404, {"error": f"no route {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                body = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/project":
+                    body = [body]
+                elif not isinstance(body, list):
+                    raise ValueError("/project/batch takes a JSON list")
+                scenarios = [validate(s) for s in body]
+                results = batcher.submit([s for s, _ in scenarios])
+            except (ValueError, KeyError, TypeError) as e:
+                self._send(400, {"error": f"{type(e).__name__}: {e}"})
+                return
+            except FutureTimeout:
+                self._send(504, {"error": "projection timed out"})
+                return
+            except Exception as e:
+                self._send(500, {"error": f"{type(e).__name__}: {e}"})
+                return
+            details = [detail for _, detail in scenarios]
+            results = [respond(r, d) for r, d in zip(results, details)]
+            self._send(200, results[0] if self.path == "/project" else results)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8502)
+    parser.add_argument("--max-batch", type=int, default=64)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--cache-size", type=int, default=4096)
+    parser.add_argument("--timeout", type=float, default=60.0)
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--parameters", nargs="+", default=REGION_PARAMETERS_PATHS)
+    parser.add_argument("--overrides", default=OVERRIDES_PATH)
+    args = parser.parse_args()
+
+    batcher = Batcher(
+        load_model(args.data, args.parameters, args.overrides),
+        max_batch=args.max_batch,
+        max_wait=args.max_wait_ms / 1000,
+        max_entries=args.cache_size,
+        timeout=args.timeout,
+    )
+    server = Server((args.host, args.port), make_handler(batcher))
+    print(f"serving projections on http://{args.host}:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
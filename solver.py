@@ -0,0 +1,317 @@
+"""
+Inverse solver: the smallest support or turnout change that takes a party to
+a seat target, e.g. the Malay support shift PH needs for 112 seats.
+
+Votes are linear in every turnout and support input, so for each seat the
+shifts at which a party holds it form one interval. Sorting the interval ends
+(the seats' margins in points) turns "how many seats at shift d" into two
+binary searches, and the cheapest change is read off those orderings instead
+of reprojecting candidate scenarios.
+"""
+import numpy as np
+import pandas as pd
+
+from engine import (
+    _state_means,
+    override_votes,
+    parties,
+    project,
+    races,
+    seat_inputs,
+    state_index,
+    support_tensor,
+    voter_matrix,
+)
+
+LEVERS = ["support", "turnout"]
+
+
+def _race_list(race):
+    if race is None:
+        return list(races)
+    return [race] if isinstance(race, str) else list(race)
+
+
+def _per_point(voters, turnout, support, lever, p, rs, from_p=None):
+    """
+    (seats x parties) votes gained per point of the lever, from per-seat
+    `seat_inputs` turnout and support.
+    """
+    D = np.zeros((len(voters), support.shape[1]))
+    if lever == "support":
+        gained = (voters[:, rs] * turnout[:, rs]).sum(axis=1) / 10000
+        D[:, p] = gained
+        if from_p is not None:
+            D[:, from_p] = -gained
+    else:
+        D = np.einsum("sr,spr->sp", voters[:, rs], support[:, :, rs]) / 10000
+    return D
+
+
+def _hold_intervals(votes, D, p, fixed, base):
+    """
+    (lo, hi) per seat: party `p` leads every other party for shifts strictly
+    between them. Seats with a base party are held everywhere or nowhere.
+    """
+    a = votes[:, [p]] - votes
+    b = D[:, [p]] - D
+    a, b = np.delete(a, p, axis=1), np.delete(b, p, axis=1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        cross = -a / b
+    lower = np.where(b > 0, cross, -np.inf)
+    upper = np.where(b < 0, cross, np.inf)
+    # no lever on this pair: p is ahead at every shift or at none
+    lower = np.where((b == 0) & (a <= 0), np.inf, lower)
+    lo, hi = lower.max(axis=1), upper.min(axis=1)
+    lo = np.where(fixed, np.where(base == p, -np.inf, np.inf), lo)
+    hi = np.where(fixed, np.where(base == p, np.inf, -np.inf), hi)
+    return lo, hi
+
+
+def _snap(values, step):
+    """Shifts just past `values`, away from zero, on the `step` grid."""
+    if step:
+        out = np.where(
+            values > 0,
+            (np.floor(values / step) + 1) * step,
+            (np.ceil(values / step) - 1) * step,
+        )
+    else:
+        out = values + np.sign(values) * 1e-6 * np.maximum(1, np.abs(values))
+    # shifts of exactly zero are not candidates
+    return out[values != 0]
+
+
+def _counter(lo, hi):
+    """Seats held at shift d, via binary searches over the sorted ends."""
+    valid = lo < hi
+    lo, hi = np.sort(lo[valid]), np.sort(hi[valid])
+
+    def count(d):
+        d = np.asarray(d, dtype=np.float64)
+        return np.searchsorted(lo, d, side="left") - np.searchsorted(
+            hi, d, side="right"
+        )
+
+    return count, np.concatenate([lo, hi])
+
+
+def _candidates(ends, lo, hi, step):
+    ends = ends[np.isfinite(ends)]
+    c = np.unique(np.concatenate([[0.0], _snap(ends, step)]))
+    return c[(c >= lo) & (c <= hi)]
+
+
+def _lever_bounds(data, states, lever, party, race, from_party=None):
+    """Shift range per state that keeps every moved input within 0-100."""
+    rs = _race_list(race)
+    out = {}
+    for state in states:
+        if lever == "support":
+            own = [data[f"{state}_{party}_{r}_support"] for r in rs]
+            lo, hi = -min(own), 100 - max(own)
+            if from_party is not None:
+                other = [data[f"{state}_{from_party}_{r}_support"] for r in rs]
+                lo = max(lo, max(other) - 100)
+                hi = min(hi, min(other))
+        else:
+            values = [data[f"{state}_{r}_turnout"] for r in rs]
+            lo, hi = -min(values), 100 - max(values)
+        out[state] = (lo, hi)
+    return out
+
+
+def apply_shifts(data, shifts, lever, party, race=None, from_party=None):
+    """Copy of `data` with the solver's per-state `shifts` applied."""
+    data = dict(data)
+    for state, shift in shifts.items():
+        for r in _race_list(race):
+            if lever == "support":
+                data[f"{state}_{party}_{r}_support"] += shift
+                if from_party is not None:
+                    data[f"{state}_{from_party}_{r}_support"] -= shift
+            else:
+                data[f"{state}_{r}_turnout"] += shift
+    return data
+
+
+def solve_target(
+    df,
+    data,
+    states,
+    party,
+    target=112,
+    lever="support",
+    race=None,
+    from_party=None,
+    mode="uniform",
+    bounds=(-20, 20),
+    state_bounds=None,
+    allowed_states=None,
+    step=1,
+    base_party=None,
+    parties=parties,
+    overrides=None,
+):
+    """
+    The cheapest shift of `lever` that gives `party` at least `target` seats.
+
+    lever: "support" moves `party`'s support in `race` (a race, a list of
+        races, or every race when None), taking it from `from_party` when
+        given; "turnout" moves the turnout of `race`.
+    mode: "uniform" applies one shift, the smallest in points, to every
+        allowed state; "per_state" lets each state move by its own amount
+        and minimises the votes moved.
+    bounds, state_bounds: the shift range in points, overall and per state
+        {state: (lo, hi)}; inputs are also kept within 0-100.
+    allowed_states: the states that move; by default those where `party`
+        (and `from_party`, when support is taken from it) stands.
+    step: shifts are rounded away from zero to this grid (the dashboard
+        inputs are whole points); None for exact thresholds.
+    base_party: per-seat safe, forced or hard-rule winners, which never
+        change.
+    overrides: `compile_overrides` seat adjustments, added to the votes and
+        to their response to the lever.
+
+    Returns a dict with the per-state `shifts`, `seats` before and after,
+    `cost` and `votes`, the shifted `data`, and `feasible`. When the target
+    is out of reach it holds the change that gets closest.
+    """
+    if lever not in LEVERS:
+        raise ValueError(f"unknown lever {lever!r}, expected one of {LEVERS}")
+    if mode not in ("uniform", "per_state"):
+        raise ValueError(f"unknown mode {mode!r}, expected 'uniform' or 'per_state'")
+    rs = [races.index(r) for r in _race_list(race)]
+    p = parties.index(party)
+    from_p = None if from_party is None else parties.index(from_party)
+    voters = voter_matrix(df)
+    sidx = state_index(df, states)
+    votes, _ = project(voters, sidx, support_tensor(data, states, parties))
+    turnout, support = _state_means(data, states, parties)
+    if overrides is not None:
+        votes = override_votes(
+            votes, df.index, voters, sidx, turnout, support, overrides
+        )
+    if allowed_states is None:
+        # by default, only where the party (and the one it takes from) stands:
+        # elsewhere the shift is pinned at 0 and would block a uniform one
+        standing = [p] if from_p is None or lever != "support" else [p, from_p]
+        allowed_states = [
+            s for k, s in enumerate(states) if (support[k, standing].sum(1) > 0).all()
+        ]
+    allowed = list(allowed_states)
+    D = _per_point(
+        voters,
+        *seat_inputs(df.index, sidx, turnout, support, overrides),
+        lever,
+        p,
+        rs,
+        from_p,
+    )
+    # only seats in allowed states respond to the shift
+    D[~np.isin(sidx, [states.index(s) for s in allowed])] = 0
+
+    base = np.full(len(df), -1)
+    if base_party is not None:
+        base = pd.Index(parties).get_indexer(pd.Series(base_party, dtype=object))
+    fixed = base >= 0
+    lo, hi = _hold_intervals(votes, D, p, fixed, base)
+    current = int(((lo < 0) & (0 < hi)).sum())
+
+    limits = _lever_bounds(data, allowed, lever, party, race, from_party)
+    for state in allowed:
+        b = (state_bounds or {}).get(state, bounds)
+        limits[state] = (max(limits[state][0], b[0]), min(limits[state][1], b[1]))
+
+    if not allowed:
+        # no state may move, so the current result stands
+        shifts = {}
+    elif mode == "uniform":
+        count, ends = _counter(lo, hi)
+        c_lo = max(l for l, _ in limits.values())
+        c_hi = min(h for _, h in limits.values())
+        c = _candidates(ends, c_lo, c_hi, step)
+        seats = count(c)
+        hit = np.flatnonzero(seats >= target)
+        if len(hit):
+            best = hit[np.argmin(np.abs(c[hit]))]
+        else:
+            best = np.lexsort((np.abs(c), -seats))[0]
+        shift = float(c[best])
+        shifts = {state: shift for state in allowed} if shift else {}
+    else:
+        shifts = _solve_per_state(
+            lo, hi, D, sidx, states, allowed, limits, step, target - current
+        )
+
+    new_data = apply_shifts(data, shifts, lever, party, race, from_party)
+    new_votes, winner = project(voters, sidx, support_tensor(new_data, states, parties))
+    if overrides is not None:
+        new_votes = override_votes(
+            new_votes,
+            df.index,
+            voters,
+            sidx,
+            *_state_means(new_data, states, parties),
+            overrides,
+        )
+        winner = new_votes.argmax(axis=1)
+    final = np.where(base >= 0, base, winner)
+    seats_after = int((final == p).sum())
+    moved = np.abs(D * np.array([shifts.get(s, 0) for s in states])[sidx][:, None])
+    votes_moved = float(moved[:, p].sum() if lever == "support" else moved.sum())
+    return {
+        "party": party,
+        "lever": lever,
+        "race": race,
+        "from_party": from_party,
+        "mode": mode,
+        "target": target,
+        "shifts": shifts,
+        "seats_before": current,
+        "seats": seats_after,
+        "feasible": seats_after >= target,
+        "cost": max(map(abs, shifts.values()), default=0.0)
+        if mode == "uniform"
+        else votes_moved,
+        "votes": votes_moved,
+        "data": new_data,
+    }
+
+
+def _solve_per_state(lo, hi, D, sidx, states, allowed, limits, step, need):
+    """
+    Per-state shifts gaining `need` seats for the fewest votes moved: each
+    state offers its candidate shifts as (seats gained, votes) options, and a
+    small knapsack over states picks one option per state.
+    """
+    if need <= 0:
+        return {}
+    # votes moved per point in each state
+    weight = np.bincount(sidx, np.abs(D).sum(axis=1), minlength=len(states))
+    options = []
+    for state in allowed:
+        s = states.index(state)
+        in_state = sidx == s
+        count, ends = _counter(lo[in_state], hi[in_state])
+        c = _candidates(ends, *limits[state], step)
+        gain = count(c) - count(0.0)
+        cost = np.abs(c) * weight[s]
+        cheapest = {}
+        for g, k, shift in zip(np.minimum(gain, need), cost, c):
+            if g > 0 and (g not in cheapest or k < cheapest[g][0]):
+                cheapest[g] = (k, float(shift))
+        options.append((state, cheapest))
+
+    # best[g]: cheapest (votes, shifts) gaining g seats, capped at `need`
+    best = {0: (0.0, {})}
+    for state, cheapest in options:
+        nxt = dict(best)
+        for g0, (k0, shifts0) in best.items():
+            for g, (k, shift) in cheapest.items():
+                g1 = min(need, g0 + g)
+                if g1 not in nxt or k0 + k < nxt[g1][0]:
+                    nxt[g1] = (k0 + k, {**shifts0, state: shift})
+        best = nxt
+    # when `need` is out of reach, the change gaining the most seats
+    return best[max(best)][1]
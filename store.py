@@ -0,0 +1,137 @@
+"""
+Saved scenarios and their seat results, in a local SQLite file.
+
+A scenario is the full set of Estimated Result inputs: the `data` dict
+generate_state_inputs builds, `undecided_malay` and `hard_base_party`.
+Results are stored under a content hash of the scenario and the dataset
+version, so a scenario saved twice, or saved under two names, is projected
+once; the least recently used results are evicted past `max_entries`.
+"""
+import hashlib
+import io
+import json
+import sqlite3
+import time
+from contextlib import closing
+
+import pandas as pd
+
+from engine import parties
+
+STORE_PATH = "data/scenarios.sqlite"
+
+RESULT_COLS = [
+    "##",
+    "state",
+    "constituency",
+    *parties,
+    "estimate_party",
+    "base_party",
+    "party",
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scenarios (
+    name TEXT PRIMARY KEY,
+    payload TEXT NOT NULL,
+    updated REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    seats TEXT NOT NULL,
+    frame BLOB NOT NULL,
+    last_used REAL NOT NULL
+);
+"""
+
+
+def _json_default(value):
+    # numpy scalars from the widgets and parameter frames
+    if hasattr(value, "item"):
+        return value.item()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+
+def dumps(scenario):
+    """Canonical JSON of `scenario`: equal scenarios give equal strings."""
+    return json.dumps(
+        scenario, sort_keys=True, separators=(",", ":"), default=_json_default
+    )
+
+
+def scenario_hash(scenario, version=""):
+    """Content hash of `scenario` under dataset `version`."""
+    return hashlib.sha1(f"{version}:{dumps(scenario)}".encode()).hexdigest()
+
+
+def connect(path=STORE_PATH):
+    conn = sqlite3.connect(path, timeout=30)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def save_scenario(name, scenario, path=STORE_PATH):
+    with closing(connect(path)) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO scenarios VALUES (?, ?, ?)",
+            (name, dumps(scenario), time.time()),
+        )
+
+
+def load_scenario(name, path=STORE_PATH):
+    """The scenario saved as `name`, or None."""
+    with closing(connect(path)) as conn:
+        row = conn.execute(
+            "SELECT payload FROM scenarios WHERE name = ?", (name,)
+        ).fetchone()
+    return None if row is None else json.loads(row[0])
+
+
+def delete_scenario(name, path=STORE_PATH):
+    with closing(connect(path)) as conn, conn:
+        conn.execute("DELETE FROM scenarios WHERE name = ?", (name,))
+
+
+def list_scenarios(path=STORE_PATH):
+    """Saved scenario names, most recently saved first."""
+    with closing(connect(path)) as conn:
+        rows = conn.execute("SELECT name FROM scenarios ORDER BY updated DESC")
+        return [name for (name,) in rows]
+
+
+def cached_result(key, path=STORE_PATH):
+    """(seat counts, per-seat frame) stored under `key`, or None."""
+    with closing(connect(path)) as conn, conn:
+        row = conn.execute(
+            "SELECT seats, frame FROM results WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        conn.execute(
+            "UPDATE results SET last_used = ? WHERE key = ?", (time.time(), key)
+        )
+    return json.loads(row[0]), pd.read_parquet(io.BytesIO(row[1]))
+
+
+def store_result(key, ndf, max_entries=256, path=STORE_PATH):
+    """
+    Store the seat counts and `RESULT_COLS` of the projected frame `ndf`
+    under `key`, evicting the least recently used results past
+    `max_entries`. Returns what `cached_result` would.
+    """
+    frame = ndf[RESULT_COLS].reset_index(drop=True)
+    frame = frame.astype({c: str for c in ["##", "state", "constituency"]})
+    seats = frame["party"].value_counts().to_dict()
+    buffer = io.BytesIO()
+    frame.to_parquet(buffer, index=False)
+    with closing(connect(path)) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?)",
+            (key, json.dumps(seats), buffer.getvalue(), time.time()),
+        )
+        conn.execute(
+            "DELETE FROM results WHERE key NOT IN "
+            "(SELECT key FROM results ORDER BY last_used DESC LIMIT ?)",
+            (max_entries,),
+        )
+    return seats, frame
@@ -0,0 +1,182 @@
+"""
+Batch scenario sweeps over the Estimated Result projection.
+
+A scenario is a dict with any of the keys `para_data`, `undecided_malay`,
+`hard_base_party`, `turnout`, `support`, `safe_threshold` and `safe_combo`
+(see `engine.scenario_inputs`); missing keys take the dashboard defaults, so
+an empty scenario reproduces the default national result.
+
+    python sweep.py grid.json -o result.parquet --processes 4
+
+where grid.json is either a list of scenarios or
+{"base": {...}, "grid": {"undecided_malay.BN": [0, 5, ...],
+"para_data.Kedah.PN_Malay_support": [28, 31, 34]}}.
+"""
+import argparse
+import copy
+import itertools
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from loader import (
+    DATA_PATH,
+    OVERRIDES_PATH,
+    REGION_PARAMETERS_PATHS,
+    load_new_voters,
+    load_overrides_frame,
+)
+from engine import (
+    compile_overrides,
+    excluded_states,
+    load_parameters,
+    parties,
+    project_states,
+    scenario_inputs,
+    seat_counts,
+    winner_codes,
+)
+
+_df = None
+_para_data = None
+_history = None
+_overrides = None
+_cache = {}
+
+
+def _init_worker(
+    data_path=DATA_PATH,
+    parameters_path=REGION_PARAMETERS_PATHS,
+    overrides_path=OVERRIDES_PATH,
+):
+    global _df, _para_data, _history, _overrides
+    df = load_new_voters(data_path)
+    _df = df[~df["state"].isin(excluded_states)].copy()
+    _para_data = load_parameters(parameters_path)
+    _history = winner_codes(_df)
+    overrides = load_overrides_frame(overrides_path)
+    _overrides = None if overrides is None else compile_overrides(overrides, _df)
+    # cached states were projected from the previous dataset
+    _cache.clear()
+
+
+def run_scenario(scenario):
+    """Seats won per party (in `engine.parties` order) for one scenario."""
+    if _df is None:
+        _init_worker()
+    states = _df["state"].unique().tolist()
+    data, hard_base_party = scenario_inputs(scenario, _para_data, states)
+    # states whose inputs repeat across scenarios come from the worker's cache
+    state_dfs = project_states(
+        _df,
+        data,
+        states,
+        hard_base_party,
+        cache=_cache,
+        history=_history,
+        overrides=_overrides,
+    )
+    return seat_counts(pd.concat(state_dfs.values())).to_numpy()
+
+
+def sweep(
+    scenarios,
+    processes=None,
+    chunksize=4,
+    data_path=DATA_PATH,
+    parameters_path=REGION_PARAMETERS_PATHS,
+):
+    """
+    (scenarios x parties) int16 array of seats won. `processes=1` runs in this
+    process; otherwise scenarios are spread over a process pool.
+    """
+    scenarios = list(scenarios)
+    if processes == 1:
+        _init_worker(data_path, parameters_path)
+        seats = [run_scenario(s) for s in scenarios]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=processes,
+            initializer=_init_worker,
+            initargs=(data_path, parameters_path),
+        ) as pool:
+            seats = list(pool.map(run_scenario, scenarios, chunksize=chunksize))
+    return np.array(seats, dtype=np.int16).reshape(len(scenarios), len(parties))
+
+
+def _set_path(scenario, path, value):
+    keys = path.split(".")
+    node = scenario
+    for key in keys[:-1]:
+        node = node.setdefault(key, {})
+    node[keys[-1]] = value
+
+
+def scenario_grid(grid, base=None, parameters_path=REGION_PARAMETERS_PATHS):
+    """
+    Cartesian product of `grid`, a dict of dotted scenario paths to values,
+    applied on top of `base`. Returns the scenarios and a frame of the swept
+    values, one row per scenario.
+    """
+    base = copy.deepcopy(base or {})
+    if any(k.startswith("para_data.") for k in grid) and "para_data" not in base:
+        base["para_data"] = load_parameters(parameters_path)
+
+    keys = list(grid.keys())
+    rows = list(itertools.product(*[grid[k] for k in keys]))
+    scenarios = []
+    for row in rows:
+        scenario = copy.deepcopy(base)
+        for k, v in zip(keys, row):
+            _set_path(scenario, k, v)
+        scenarios.append(scenario)
+    return scenarios, pd.DataFrame(rows, columns=keys)
+
+
+def sweep_frame(scenarios, index=None, **kwargs):
+    """`sweep` results as a frame with one column per party."""
+    seats = sweep(scenarios, **kwargs)
+    result = pd.DataFrame(seats, columns=parties)
+    if index is not None:
+        result = pd.concat([index.reset_index(drop=True), result], axis=1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0].strip())
+    parser.add_argument("scenarios", help="JSON list of scenarios or base/grid spec")
+    parser.add_argument("-o", "--output", help=".parquet or .csv result file")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--data", default=DATA_PATH)
+    parser.add_argument("--parameters", nargs="+", default=REGION_PARAMETERS_PATHS)
+    args = parser.parse_args()
+
+    with open(args.scenarios) as f:
+        spec = json.load(f)
+    if isinstance(spec, dict):
+        scenarios, index = scenario_grid(
+            spec.get("grid", {}), spec.get("base"), args.parameters
+        )
+    else:
+        scenarios, index = spec, None
+
+    result = sweep_frame(
+        scenarios,
+        index=index,
+        processes=args.processes,
+        data_path=args.data,
+        parameters_path=args.parameters,
+    )
+    if args.output is None:
+        print(result.to_string())
+    elif args.output.endswith(".parquet"):
+        result.to_parquet(args.output, index=False)
+    else:
+        result.to_csv(args.output, index=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""
+Stage timings for one script run. Every timed stage is recorded on its run
+and emitted as one JSON log line on the "general_election.timing" logger,
+e.g.
+
+    {"run": "3f2a9c1b07de", "session": "...", "stage": "generate_state",
+     "state": "Perak", "rows": 24, "ms": 41.2}
+
+Set TIMING_LOG=1 to have the lines written to stderr; otherwise they go
+wherever the logger is configured to send them.
+"""
+import json
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+import pandas as pd
+
+logger = logging.getLogger("general_election.timing")
+if os.environ.get("TIMING_LOG"):
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
+
+def new_run(**fields):
+    """A timing run; `fields` (e.g. the session id) go on every log line."""
+    return {"run": uuid.uuid4().hex[:12], **fields, "records": []}
+
+
+@contextmanager
+def stage(run, name, **fields):
+    """
+    Time the body as stage `name` of `run`. The yielded record can be given
+    more fields inside the body, typically `rows`.
+    """
+    record = {"stage": name, **fields}
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["ms"] = round((time.perf_counter() - start) * 1000, 3)
+        run["records"].append(record)
+        if logger.isEnabledFor(logging.INFO):
+            line = {k: v for k, v in run.items() if k != "records"}
+            logger.info(json.dumps({**line, **record}, default=str))
+
+
+def timings_frame(run):
+    """The records of `run` as a frame, in the order the stages finished."""
+    columns = ["stage", "ms", "rows"]
+    frame = pd.DataFrame(run["records"])
+    for col in columns:
+        if col not in frame:
+            frame[col] = None
+    frame["rows"] = frame["rows"].astype("Int64")
+    return frame[columns + [c for c in frame.columns if c not in columns]]